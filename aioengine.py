@@ -0,0 +1,145 @@
+import asyncio
+import urllib.parse
+import urllib.error
+import email.message
+import ssl
+import os
+import functools
+import segmented
+
+
+MAX_REDIRECTS = 5
+WRITE_BUFFER_SIZE = 1048576
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssl_context():
+	#loading the trust store costs more than the handshake it verifies, every range shares one context
+	return ssl.create_default_context()
+
+
+async def open_request(url, headers, redirects=MAX_REDIRECTS):
+	parts = urllib.parse.urlsplit(url)
+	secure = parts.scheme == 'https'
+	port = parts.port or (443 if secure else 80)
+	reader, writer = await asyncio.open_connection(parts.hostname, port, ssl=get_ssl_context() if secure else None)
+	target = parts.path or '/'
+	if parts.query:
+		target += '?' + parts.query
+	lines = ['GET {} HTTP/1.1'.format(target), 'Host: {}'.format(parts.netloc), 'Connection: close']
+	lines += ['{}: {}'.format(name, value) for name, value in headers.items()]
+	writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+	await writer.drain()
+	status_line = await reader.readline()
+	status = int(status_line.split()[1])
+	response_headers = email.message.Message()
+	while True:
+		line = await reader.readline()
+		if line in (b'\r\n', b'\n', b''):
+			break
+		name, _, value = line.decode('latin-1').partition(':')
+		response_headers[name.strip()] = value.strip()
+	if status in (301, 302, 303, 307, 308) and redirects and response_headers['Location']:
+		writer.close()
+		return await open_request(urllib.parse.urljoin(url, response_headers['Location']), headers, redirects-1)
+	if status >= 400:
+		writer.close()
+		raise urllib.error.HTTPError(url, status, status_line.decode('latin-1').strip(), response_headers, None)
+	return status, response_headers, reader, writer
+
+
+async def read_body(reader, headers, length):
+	if headers.get('Transfer-Encoding', '').lower() == 'chunked':
+		while True:
+			size = int((await reader.readline()).split(b';')[0], 16)
+			if not size:
+				break
+			remaining = size
+			while remaining:
+				chunk = await reader.read(min(segmented.CHUNK_SIZE, remaining))
+				if not chunk:
+					raise asyncio.IncompleteReadError(b'', remaining)
+				remaining -= len(chunk)
+				yield chunk
+			await reader.readline()
+		return
+	remaining = int(headers.get('Content-Length', length))
+	while remaining:
+		chunk = await reader.read(min(segmented.CHUNK_SIZE, remaining))
+		if not chunk:
+			raise asyncio.IncompleteReadError(b'', remaining)
+		remaining -= len(chunk)
+		yield chunk
+
+
+async def fetch_range(url, start, end, filesize, file_path, on_chunk):
+	loop = asyncio.get_running_loop()
+	status, headers, reader, writer = await open_request(url, dict(segmented.REQUEST_HEADERS, Range='bytes={}-{}'.format(start, end)))
+	try:
+		if status != 206:
+			raise segmented.RangeNotSupported(url)
+		total = headers.get('Content-Range', '').rpartition('/')[2]
+		if total.isdigit() and int(total) != filesize:
+			raise segmented.RemoteChanged('{} reports {} bytes, expected {}'.format(url, total, filesize))
+		fh = await loop.run_in_executor(None, open, file_path, 'r+b')
+		try:
+			position = start
+			buffer = bytearray()
+			async for chunk in read_body(reader, headers, end-start+1):
+				buffer += chunk
+				await on_chunk(chunk)
+				if len(buffer) >= WRITE_BUFFER_SIZE:
+					await loop.run_in_executor(None, write_at, fh, position, bytes(buffer))
+					position += len(buffer)
+					buffer.clear()
+			if buffer:
+				await loop.run_in_executor(None, write_at, fh, position, bytes(buffer))
+		finally:
+			await loop.run_in_executor(None, fh.close)
+	finally:
+		writer.close()
+
+
+def write_at(fh, position, data):
+	fh.seek(position)
+	fh.write(data)
+
+
+def preallocate(file_path, filesize):
+	with open(file_path, 'wb') as fh:
+		fh.truncate(filesize)
+
+
+async def download(url, filesize, file_path, connections, on_chunk):
+	loop = asyncio.get_running_loop()
+	part_path = file_path + segmented.PART_SUFFIX
+	#the segmented downloader trusts its journal over the part file, one left from it must not outlive the part being zeroed
+	await loop.run_in_executor(None, segmented.DownloadJournal(part_path + segmented.JOURNAL_SUFFIX).remove)
+	await loop.run_in_executor(None, preallocate, part_path, filesize)
+	ranges = asyncio.Queue()
+	for byte_range in segmented.split_ranges(filesize):
+		ranges.put_nowait(byte_range)
+	async def fetch_ranges():
+		while not ranges.empty():
+			start, end = ranges.get_nowait()
+			await fetch_range(url, start, end, filesize, part_path, on_chunk)
+	workers = [asyncio.ensure_future(fetch_ranges()) for _ in range(max(1, connections))]
+	try:
+		done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+		for worker in done:
+			worker.result()
+	except BaseException:
+		for worker in workers:
+			worker.cancel()
+		await asyncio.gather(*workers, return_exceptions=True)
+		await loop.run_in_executor(None, remove_file, part_path)
+		raise
+	await loop.run_in_executor(None, os.replace, part_path, file_path)
+	return file_path
+
+
+def remove_file(file_path):
+	try:
+		os.remove(file_path)
+	except FileNotFoundError:
+		pass
@@ -1,86 +1,606 @@
 import pytube
 import http.client
+import urllib.error
+import concurrent.futures
+import queue
+import threading
 import multiprocessing
-import multiprocessing.managers
+import heapq
+import itertools
 import shutil
 import os
 import subprocess
 import platform
+import time
+import uuid
+import contextlib
+import collections
+import segmented
+import cache
+import ratelimit
+import syncindex
+import streamindex
+import metrics
+import budget
+import contentstore
+import aioengine
+import asyncio
+import functools
+import httppool
 
+if platform.system() == 'Windows':
+	import msvcrt
+else:
+	import fcntl
 
+
+#pytube's metadata lookups share the keep-alive connections of the downloads
+pytube.request._execute_request = httppool.execute_pytube_request
+
+
+PLAYLIST_WORKERS = 4
+PLAYLIST_RESOLVE_WORKERS = 2
+PLAYLIST_PREFETCH = 4
+BULK_VALIDATION_WORKERS = 8
+MUX_WORKERS = 2
+TRANSCODE_WORKERS = os.cpu_count() or 1
+STREAM_CONNECTIONS = segmented.DEFAULT_CONNECTIONS
+STREAMING_MUX = True
+MAX_CONCURRENT_TASKS = 3
+SCHEDULER_POLL_INTERVAL = 0.1
+
+ENGINE_PROCESS = 'process'
+ENGINE_ASYNCIO = 'asyncio'
+DOWNLOAD_ENGINE = ENGINE_PROCESS
+ASYNC_MAX_CONCURRENT_TASKS = 64
+
+GLOBAL_RATE_LIMIT = 0
+TASK_RATE_LIMIT = 0
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+STAGING_DIRNAME = '.minytd-staging'
+STAGING_LOCK_SUFFIX = '.lock'
+STAGING_DISCARD_WAIT = 1
+
+AUDIO_ONLY_M4A = 'Audio only (m4a)'
+AUDIO_ONLY_MP3 = 'Audio only (mp3)'
+AUDIO_FORMATS = {AUDIO_ONLY_M4A:'m4a', AUDIO_ONLY_MP3:'mp3'}
+#ffmpeg codec arguments and muxer per output format, m4a is a remux of the mp4 audio stream and mp3 a transcode
+AUDIO_FORMAT_ARGS = {'m4a':(['-c:a', 'copy'], 'ipod'), 'mp3':(['-c:a', 'libmp3lame', '-q:a', '2'], 'mp3')}
+
+STARTUP_TIMINGS = ('window_seconds', 'backend_seconds')
+
+
+@functools.lru_cache(maxsize=None)
 def check_ffmpeg_exists():
-	if platform.system()=='Windows':
-		try:
-			subprocess.call('ffmpeg', creationflags = subprocess.CREATE_NO_WINDOW)
-			return True
-		except FileNotFoundError:
-			return False
-	else:
-		try:
-			subprocess.call('ffmpeg')
-			return True
-		except FileNotFoundError:
-			return False
+	#probed once per process, tasks get the result handed to them instead of probing again
+	if not shutil.which('ffmpeg'):
+		return False
+	kwargs = {'creationflags':subprocess.CREATE_NO_WINDOW} if platform.system()=='Windows' else {}
+	try:
+		subprocess.call(['ffmpeg', '-version'], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **kwargs)
+		return True
+	except OSError:
+		return False
 			
 		
+def resolve_video(url, manifest_cache):
+	yt = manifest_cache.get_video(pytube.extract.video_id(url))
+	if yt is None:
+		yt = pytube.YouTube(url)
+		manifest_cache.put_video(yt)
+	return yt
+	
+	
+def resolve_playlist_urls(playlist_obj, manifest_cache):
+	video_ids = manifest_cache.get_playlist(playlist_obj.playlist_id)
+	if video_ids is None:
+		video_urls = playlist_obj.video_urls
+		manifest_cache.put_playlist(playlist_obj.playlist_id, [pytube.extract.video_id(url) for url in video_urls])
+		return video_urls
+	return ['https://www.youtube.com/watch?v='+video_id for video_id in video_ids]
+	
+		
 def call_ffmpeg(video_stream, audio_stream, output_stream):
 	if platform.system()=='Windows':
 		subprocess.call(['ffmpeg', '-i', video_stream, '-i', audio_stream, '-c', 'copy', output_stream], creationflags = subprocess.CREATE_NO_WINDOW)
 	else:
 		subprocess.call(['ffmpeg', '-i', video_stream, '-i', audio_stream, '-c', 'copy', output_stream])
 		
+
+def call_ffmpeg_audio(input_stream, output_stream, audio_format):
+	codec_args, muxer = AUDIO_FORMAT_ARGS[audio_format]
+	kwargs = {'creationflags':subprocess.CREATE_NO_WINDOW} if platform.system()=='Windows' else {}
+	subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', input_stream, '-vn'] + codec_args + ['-f', muxer, output_stream], stdin=subprocess.DEVNULL, check=True, **kwargs)
+	
+	
+def get_staging_directory(destination):
+	#staging inside the destination keeps the final move a rename on the same filesystem
+	return os.path.join(destination, STAGING_DIRNAME)
+	
+	
+def get_video_staging_name(video_id, itags):
+	#stable across tasks and restarts, so a re-queued download finds its .part file and journal again
+	return '{}-{}'.format(video_id, '+'.join(str(itag) for itag in itags))
+	
+	
+def remove_empty_directory(directory):
+	with contextlib.suppress(OSError):
+		os.rmdir(directory)
 		
-class SharedClasses(multiprocessing.managers.BaseManager):
-	pass
+		
+def lock_staging_directory(directory):
+	#held while a task stages into the folder, the lock file sits next to it so removing the folder keeps it intact
+	lock_path = directory + STAGING_LOCK_SUFFIX
+	while True:
+		fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			if platform.system() == 'Windows':
+				msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+			else:
+				fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except OSError:
+			os.close(fd)
+			raise StagingBusy(directory)
+		try:
+			#the previous owner may have removed the file between our open and lock, then the lock guards nothing
+			if os.path.samestat(os.fstat(fd), os.stat(lock_path)):
+				return fd
+		except FileNotFoundError:
+			pass
+		os.close(fd)
+		
+		
+def unlock_staging_directory(directory, fd):
+	#removed while still locked, so nobody can lock the file between the unlock and the removal
+	with contextlib.suppress(OSError):
+		os.remove(directory + STAGING_LOCK_SUFFIX)
+	if platform.system() == 'Windows':
+		with contextlib.suppress(OSError):
+			msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+	os.close(fd)
+	if platform.system() == 'Windows':
+		#open files cannot be removed there, so it only goes once closed
+		with contextlib.suppress(OSError):
+			os.remove(directory + STAGING_LOCK_SUFFIX)
+		
+		
+def discard_staged_videos(staging_directory, video_ids):
+	#video ids have a fixed length, so the id and its dash never prefix another video's folder
+	prefixes = tuple(video_id + '-' for video_id in video_ids)
+	try:
+		names = os.listdir(staging_directory)
+	except OSError:
+		return
+	directories = {os.path.join(staging_directory, name[:-len(STAGING_LOCK_SUFFIX)] if name.endswith(STAGING_LOCK_SUFFIX) else name) for name in names if prefixes and name.startswith(prefixes)}
+	for directory in directories:
+		#a task that was just killed lets go of its folders a moment later, one staging the same video now keeps them
+		deadline = time.monotonic() + STAGING_DISCARD_WAIT
+		while True:
+			try:
+				fd = lock_staging_directory(directory)
+				break
+			except StagingBusy:
+				if time.monotonic() >= deadline:
+					fd = None
+					break
+				time.sleep(SCHEDULER_POLL_INTERVAL)
+		if fd is None:
+			continue
+		shutil.rmtree(directory, ignore_errors=True)
+		unlock_staging_directory(directory, fd)
+	remove_empty_directory(staging_directory)
+	
+	
+def get_audio_resolutions(ffmpeg_exists):
+	return [AUDIO_ONLY_M4A, AUDIO_ONLY_MP3] if ffmpeg_exists else [AUDIO_ONLY_M4A]
+	
 
+def supports_streaming_mux():
+	return platform.system()!='Windows'
+	
+	
+def open_ffmpeg_pipes(output_stream, output_format):
+	video_read, video_write = os.pipe()
+	audio_read, audio_write = os.pipe()
+	try:
+		process = subprocess.Popen(['ffmpeg', '-y', '-loglevel', 'error', '-i', 'pipe:{}'.format(video_read), '-i', 'pipe:{}'.format(audio_read), '-c', 'copy', '-f', output_format, output_stream], stdin=subprocess.DEVNULL, pass_fds=(video_read, audio_read))
+	except:
+		os.close(video_write)
+		os.close(audio_write)
+		raise
+	finally:
+		os.close(video_read)
+		os.close(audio_read)
+	return process, os.fdopen(video_write, 'wb'), os.fdopen(audio_write, 'wb')
 	
-class SharedProgress:
-	def __init__(self):
-		self.progress = 0
 		
-	def update_progress(self, progress):
-		self.progress = progress
+PROGRESS_SLOTS = 512
+PROGRESS_UPDATE_INTERVAL = 0.1
+PROGRESS_RATE_SMOOTHING = 0.3
+PROGRESS_READ_RETRIES = 100
+
+STATE_IDLE = 0
+STATE_RUNNING = 1
+STATE_COMPLETE = 2
+STATE_FAILED = 3
+STATE_NAMES = {STATE_IDLE:'queued', STATE_RUNNING:'running', STATE_COMPLETE:'complete', STATE_FAILED:'failed'}
+
+#slot layout: sequence, done, total, state, rate written by the task, rate limit written by the app
+SLOT_SEQUENCE = 0
+SLOT_DONE = 1
+SLOT_TOTAL = 2
+SLOT_STATE = 3
+SLOT_RATE = 4
+SLOT_RATE_LIMIT = 5
+SLOT_FIELDS = 6
+
+
+class DownloadCancelled(Exception):
+	pass
+
+
+class StagingBusy(Exception):
+	pass
+
+
+class ProgressTable:
+	def __init__(self, slots=PROGRESS_SLOTS):
+		self.values = multiprocessing.RawArray('d', slots*SLOT_FIELDS)
+		self.free_slots = list(range(slots-1, -1, -1))
+		self.lock = threading.Lock()
 		
-	def get_progress(self):
-		return self.progress
+	def allocate(self):
+		with self.lock:
+			if not self.free_slots:
+				raise RuntimeError('All {} progress slots are in use'.format(len(self.values)//SLOT_FIELDS))
+			slot = self.free_slots.pop()
+		base = slot*SLOT_FIELDS
+		self.values[base:base+SLOT_FIELDS] = [0.0]*SLOT_FIELDS
+		return SharedProgress(self.values, slot)
+		
+	def read_many(self, shared_progress_objs):
+		#one copy of the whole table per poll, only slots caught mid-write are read again on their own
+		snapshot = self.values[:]
+		fields = []
+		for shared_progress_obj in shared_progress_objs:
+			if shared_progress_obj.detached:
+				fields.append(shared_progress_obj.detached)
+				continue
+			base = shared_progress_obj.base
+			sequence = snapshot[base+SLOT_SEQUENCE]
+			if sequence % 2 or self.values[base+SLOT_SEQUENCE] != sequence:
+				fields.append(shared_progress_obj.read())
+			else:
+				fields.append(snapshot[base:base+SLOT_FIELDS])
+		return fields
+		
+	def release(self, shared_progress_obj):
+		if shared_progress_obj.detached:
+			return
+		shared_progress_obj.detach()
+		with self.lock:
+			self.free_slots.append(shared_progress_obj.slot)
+			
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['lock']
+		return state
+		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.lock = threading.Lock()
 
 
-class SharedCompletionStatus:
-	def __init__(self):
-		self.is_complete = False
+class SharedProgress:
+	def __init__(self, values, slot):
+		self.values = values
+		self.slot = slot
+		self.base = slot*SLOT_FIELDS
+		self.writer_lock = threading.Lock()
+		self.last_write = 0
+		self.last_done = 0
+		self.rate = 0
+		self.detached = None
+		
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		del state['writer_lock']
+		return state
 		
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.writer_lock = threading.Lock()
+		
+	def update_progress(self, done, total, state=STATE_RUNNING):
+		now = time.monotonic()
+		with self.writer_lock:
+			elapsed = now - self.last_write
+			if elapsed < PROGRESS_UPDATE_INTERVAL and done < total and state == STATE_RUNNING:
+				return
+			if self.last_write and elapsed > 0:
+				instant_rate = max(0, done-self.last_done) / elapsed
+				self.rate += PROGRESS_RATE_SMOOTHING * (instant_rate-self.rate)
+			self.last_write = now
+			self.last_done = done
+			self.write(done, total, state, self.rate)
+			
+	def on_start(self):
+		with self.writer_lock:
+			self.write(0, 0, STATE_RUNNING, 0)
+			
 	def on_complete(self):
-		self.is_complete = True
+		self.finish(STATE_COMPLETE)
+			
+	def on_failure(self):
+		self.finish(STATE_FAILED)
+		
+	def finish(self, state):
+		with self.writer_lock:
+			base = self.base
+			self.write(self.values[base+SLOT_DONE], self.values[base+SLOT_TOTAL], state, self.rate)
+		
+	def write(self, done, total, state, rate):
+		#writers hold writer_lock, so once detached no late write reaches a slot that may belong to another task
+		if self.detached:
+			return
+		base = self.base
+		sequence = self.values[base+SLOT_SEQUENCE]
+		self.values[base+SLOT_SEQUENCE] = sequence + 1
+		self.values[base+SLOT_DONE:base+SLOT_RATE+1] = [done, total, state, rate]
+		self.values[base+SLOT_SEQUENCE] = sequence + 2
+		
+	def read(self):
+		if self.detached:
+			return self.detached
+		base = self.base
+		for _ in range(PROGRESS_READ_RETRIES):
+			sequence = self.values[base+SLOT_SEQUENCE]
+			fields = self.values[base:base+SLOT_FIELDS]
+			if not sequence % 2 and self.values[base+SLOT_SEQUENCE] == sequence:
+				return fields
+		#writer was terminated mid-update, the slot will not settle
+		return fields
+		
+	def detach(self):
+		with self.writer_lock:
+			self.detached = self.read()
+		
+	def get_progress(self):
+		return get_fields_progress(self.read())
+		
+	def get_rate(self):
+		return self.read()[SLOT_RATE]
 		
 	def get_completion_status(self):
-		return self.is_complete
+		return self.read()[SLOT_STATE] == STATE_COMPLETE
+		
+	def set_rate_limit(self, rate_limit):
+		self.values[self.base+SLOT_RATE_LIMIT] = rate_limit
+		
+	def get_rate_limit(self):
+		return self.values[self.base+SLOT_RATE_LIMIT]
+		
+	def get_start_status(self):
+		return self.read()[SLOT_STATE] != STATE_IDLE
+		
+	def get_failure_status(self):
+		return self.read()[SLOT_STATE] == STATE_FAILED
+
+
+def get_fields_progress(fields):
+	_, done, total, state, _, _ = fields
+	if state == STATE_COMPLETE:
+		return 100
+	return (done/total) * 100 if total else 0
+	
+
+def run_download_worker(connection, progress_values, bandwidth_limiter):
+	while True:
+		job = connection.recv()
+		if job is None:
+			break
+		video_obj, playlist_obj, resolution, destination, slot, workers, connections, ffmpeg_exists, staging_directory, budget_limits = job
+		shared_progress_obj = SharedProgress(progress_values, slot)
+		try:
+			TaskDownloader(video_obj, playlist_obj, resolution, destination, shared_progress_obj, workers, connections, bandwidth_limiter, ffmpeg_exists, staging_directory, budget_limits).download()
+			connection.send(True)
+		except Exception:
+			shared_progress_obj.on_failure()
+			connection.send(False)
+
+
+class DownloadWorker:
+	def __init__(self, progress_values, bandwidth_limiter):
+		self.bandwidth_limiter = bandwidth_limiter
+		self.connection, child_connection = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=run_download_worker, args=(child_connection, progress_values, bandwidth_limiter), daemon=True)
+		self.process.start()
+		child_connection.close()
+		self.task = None
+		self.lost = False
+		
+	def run(self, task):
+		self.task = task
+		self.lost = False
+		self.connection.send(task.job())
+		
+	def is_finished(self):
+		if not self.connection.poll() and self.process.is_alive():
+			return False
+		try:
+			#a worker that replied just before exiting still finished its task
+			self.connection.recv()
+		except (EOFError, OSError):
+			self.lost = True
+		return True
+		
+	def stop(self):
+		try:
+			self.connection.send(None)
+		except (OSError, EOFError):
+			pass
+		self.process.join(1)
+		self.terminate()
+		
+	def terminate(self):
+		if self.process.is_alive():
+			#holding the bandwidth lock keeps the worker out of it until it is gone, so it cannot die owning it
+			with self.bandwidth_limiter.locked() if self.bandwidth_limiter else contextlib.nullcontext():
+				self.process.terminate()
+				self.process.join()
+		self.process.join()
+		if self.bandwidth_limiter:
+			self.bandwidth_limiter.recover(self.process.pid)
+		self.connection.close()
+
+
+class DownloadScheduler:
+	def __init__(self, progress_table, max_concurrency=MAX_CONCURRENT_TASKS, bandwidth_limiter=None):
+		self.progress_table = progress_table
+		self.bandwidth_limiter = bandwidth_limiter
+		self.max_concurrency = max(1, max_concurrency)
+		self.queue = []
+		self.sequence = itertools.count()
+		self.idle_workers = []
+		self.busy_workers = []
+		self.lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.dispatcher = None
+		
+	def submit(self, task, priority=PRIORITY_NORMAL):
+		with self.lock:
+			heapq.heappush(self.queue, (priority, next(self.sequence), task))
+			if not self.dispatcher:
+				self.dispatcher = threading.Thread(target=self.dispatch_loop, daemon=True)
+				self.dispatcher.start()
+		self.wakeup.set()
+		
+	def cancel(self, task):
+		with self.lock:
+			for entry in self.queue:
+				if entry[2] is task:
+					self.queue.remove(entry)
+					heapq.heapify(self.queue)
+					return
+			for worker in self.busy_workers:
+				if worker.task is task:
+					#the worker process is torn down with the task, a fresh one replaces it on demand
+					self.busy_workers.remove(worker)
+					worker.terminate()
+					break
+		self.wakeup.set()
+		
+	def set_max_concurrency(self, max_concurrency):
+		with self.lock:
+			self.max_concurrency = max(1, max_concurrency)
+		self.wakeup.set()
+		
+	def pending_count(self):
+		with self.lock:
+			return len(self.queue)
+		
+	def shutdown(self):
+		with self.lock:
+			self.queue = []
+			for worker in self.idle_workers + self.busy_workers:
+				worker.terminate()
+			self.idle_workers = []
+			self.busy_workers = []
+		
+	def dispatch_loop(self):
+		while True:
+			self.wakeup.wait(SCHEDULER_POLL_INTERVAL)
+			self.wakeup.clear()
+			with self.lock:
+				self.reap_workers()
+				self.start_queued_tasks()
+				
+	def reap_workers(self):
+		for worker in list(self.busy_workers):
+			if worker.is_finished():
+				self.busy_workers.remove(worker)
+				if worker.lost and not worker.task.is_complete():
+					#killed from outside, like by the OOM killer, it never got to mark its task failed
+					worker.task.shared_progress_obj.on_failure()
+				worker.task = None
+				if worker.process.is_alive():
+					self.idle_workers.append(worker)
+				else:
+					worker.terminate()
+					
+	def start_queued_tasks(self):
+		while self.queue and len(self.busy_workers) < self.max_concurrency:
+			_, _, task = heapq.heappop(self.queue)
+			worker = None
+			try:
+				worker = self.idle_workers.pop() if self.idle_workers else DownloadWorker(self.progress_table.values, self.bandwidth_limiter)
+				worker.run(task)
+			except Exception:
+				#a job that cannot be handed over, like one that does not pickle, fails alone instead of stopping the dispatcher
+				task.shared_progress_obj.on_failure()
+				if worker:
+					worker.task = None
+					if worker.process.is_alive():
+						self.idle_workers.append(worker)
+					else:
+						worker.terminate()
+				continue
+			self.busy_workers.append(worker)
+		while self.idle_workers and len(self.idle_workers)+len(self.busy_workers) > self.max_concurrency:
+			self.idle_workers.pop().stop()
+
 
+def get_task_video_ids(task):
+	if task.playlist_obj is None:
+		return [task.video_obj.video_id]
+	return cache.ManifestCache().get_playlist(task.playlist_obj.playlist_id) or []
 
-class Task:
-	def __init__(self, video_obj, playlist_obj, res, dest, shared_classes_obj):
+
+class BaseTask:
+	def __init__(self, video_obj, playlist_obj, res, dest, progress_table, workers, connections, priority, rate_limit, ffmpeg_exists, budget_limits):
 		self.video_obj = video_obj
 		self.playlist_obj = playlist_obj
 		self.resolution = res
 		self.destination = dest
-		self.shared_progress_obj = shared_classes_obj.SharedProgress()
-		self.shared_completion_status_obj = shared_classes_obj.SharedCompletionStatus()
-		self.process = multiprocessing.Process(target=self.initiate_download)
-		self.title = self.video_obj.title if not self.playlist_obj else ('Playlist-'+self.video_obj.title)
+		self.workers = workers
+		self.connections = connections
+		self.priority = priority
+		self.ffmpeg_exists = ffmpeg_exists
+		self.budget_limits = budget_limits
+		self.staging_directory = get_staging_directory(dest)
+		self.progress_table = progress_table
+		self.shared_progress_obj = progress_table.allocate()
+		self.shared_progress_obj.set_rate_limit(rate_limit)
+		self.title = self.video_obj.title if self.playlist_obj is None else ('Playlist-'+self.video_obj.title)
 		self._is_killed = False
 	
 	def start(self):
-		self.process.start()
+		raise NotImplementedError
+		
+	def cancel(self):
+		raise NotImplementedError
 	
 	def kill(self):
-		if self.process.is_alive():
-			self.process.terminate()
-			self.process.join()
+		#partial files stay staged, queueing the same download again resumes them
+		self.cancel()
 		if not self.is_complete():
-			self._is_killed = True	
+			self._is_killed = True
+		self.release()
+		
+	def release(self):
+		#finished tasks hand their slot back too, the last reading stays available to the getters
+		self.progress_table.release(self.shared_progress_obj)
+		
+	def discard(self):
+		self.kill()
+		discard_staged_videos(self.staging_directory, get_task_video_ids(self))
 
-	def initiate_download(self):
-		downloader_obj = TaskDownloader(self.video_obj, self.playlist_obj, self.resolution, self.destination, self.shared_progress_obj, self.shared_completion_status_obj)
-		downloader_obj.download()
+	def set_rate_limit(self, rate_limit):
+		self.shared_progress_obj.set_rate_limit(rate_limit)
 		
 	def get_progress(self):
 		return self.shared_progress_obj.get_progress()
@@ -89,7 +609,113 @@ class Task:
 		return self._is_killed
 		
 	def is_complete(self):
-		return self.shared_completion_status_obj.get_completion_status()
+		return self.shared_progress_obj.get_completion_status()
+		
+	def is_queued(self):
+		return not self._is_killed and not self.shared_progress_obj.get_start_status()
+		
+	def is_failed(self):
+		return self.shared_progress_obj.get_failure_status()
+		
+	def get_rate(self):
+		return self.shared_progress_obj.get_rate()
+
+
+class Task(BaseTask):
+	def __init__(self, video_obj, playlist_obj, res, dest, scheduler, workers=PLAYLIST_WORKERS, connections=STREAM_CONNECTIONS, priority=PRIORITY_NORMAL, rate_limit=TASK_RATE_LIMIT, ffmpeg_exists=None, budget_limits=None):
+		super().__init__(video_obj, playlist_obj, res, dest, scheduler.progress_table, workers, connections, priority, rate_limit, ffmpeg_exists, budget_limits)
+		self.scheduler = scheduler
+	
+	def start(self):
+		self.scheduler.submit(self, self.priority)
+		
+	def cancel(self):
+		self.scheduler.cancel(self)
+
+	def job(self):
+		return (self.video_obj, self.playlist_obj, self.resolution, self.destination, self.shared_progress_obj.slot, self.workers, self.connections, self.ffmpeg_exists, self.staging_directory, self.budget_limits)
+
+
+class AsyncDownloadEngine:
+	def __init__(self, progress_table, max_concurrency=ASYNC_MAX_CONCURRENT_TASKS, bandwidth_limiter=None):
+		self.progress_table = progress_table
+		self.max_concurrency = max(1, max_concurrency)
+		self.bandwidth_limiter = bandwidth_limiter
+		self.loop = None
+		self.lock = threading.Lock()
+		#only touched from the loop thread, waiting tasks are admitted by priority like the process scheduler's queue
+		self.running = 0
+		self.waiters = []
+		self.sequence = itertools.count()
+		
+	def ensure_loop(self):
+		with self.lock:
+			if not self.loop:
+				self.loop = asyncio.new_event_loop()
+				threading.Thread(target=self.loop.run_forever, daemon=True).start()
+		return self.loop
+		
+	def submit(self, task, priority=PRIORITY_NORMAL):
+		return asyncio.run_coroutine_threadsafe(self.run_task(task, priority), self.ensure_loop())
+		
+	def set_max_concurrency(self, max_concurrency):
+		self.max_concurrency = max(1, max_concurrency)
+		if self.loop:
+			self.loop.call_soon_threadsafe(self.admit_waiters)
+		
+	def admit_waiters(self):
+		while self.waiters and self.running < self.max_concurrency:
+			_, _, waiter = heapq.heappop(self.waiters)
+			if not waiter.done():
+				self.running += 1
+				waiter.set_result(None)
+				
+	async def acquire(self, priority):
+		waiter = asyncio.get_running_loop().create_future()
+		heapq.heappush(self.waiters, (priority, next(self.sequence), waiter))
+		self.admit_waiters()
+		try:
+			await waiter
+		except asyncio.CancelledError:
+			#admitted just before the kill landed, the place goes to the next waiter
+			if waiter.done() and not waiter.cancelled():
+				self.release()
+			raise
+			
+	def release(self):
+		self.running -= 1
+		self.admit_waiters()
+		
+	async def run_task(self, task, priority):
+		await self.acquire(priority)
+		try:
+			loop = asyncio.get_running_loop()
+			downloader = await loop.run_in_executor(None, AsyncTaskDownloader, task.video_obj, task.playlist_obj, task.resolution, task.destination, task.shared_progress_obj, task.workers, task.connections, self.bandwidth_limiter, task.ffmpeg_exists, task.staging_directory, task.budget_limits)
+			await downloader.download_async()
+		except Exception:
+			task.shared_progress_obj.on_failure()
+		finally:
+			self.release()
+			
+	def shutdown(self):
+		if self.loop:
+			for task in asyncio.all_tasks(self.loop):
+				self.loop.call_soon_threadsafe(task.cancel)
+			self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class AsyncTask(BaseTask):
+	def __init__(self, video_obj, playlist_obj, res, dest, engine, workers=PLAYLIST_WORKERS, connections=STREAM_CONNECTIONS, priority=PRIORITY_NORMAL, rate_limit=TASK_RATE_LIMIT, ffmpeg_exists=None, budget_limits=None):
+		super().__init__(video_obj, playlist_obj, res, dest, engine.progress_table, workers, connections, priority, rate_limit, ffmpeg_exists, budget_limits)
+		self.engine = engine
+		self.future = None
+		
+	def start(self):
+		self.future = self.engine.submit(self, self.priority)
+		
+	def cancel(self):
+		if self.future:
+			self.future.cancel()
 
 
 class YTD:
@@ -103,186 +729,820 @@ class YTD:
 		self.resolutions_available = []
 		self.video_obj = None
 		self.playlist_obj = None
-		self.shared_classes_obj = SharedClasses()
-		self.shared_classes_obj.register('SharedProgress', SharedProgress)
-		self.shared_classes_obj.register('SharedCompletionStatus', SharedCompletionStatus)
-		self.shared_classes_obj.start()
+		self.playlist_workers = PLAYLIST_WORKERS
+		self.stream_connections = STREAM_CONNECTIONS
+		self.progress_table = ProgressTable()
+		self.bandwidth_limiter = ratelimit.TokenBucket(GLOBAL_RATE_LIMIT, shared=True)
+		self.task_rate_limit = TASK_RATE_LIMIT
+		#total bytes and seconds a task may take, quality is lowered per video to stay inside them
+		self.size_budget = None
+		self.time_budget = None
+		self.scheduler = DownloadScheduler(self.progress_table, MAX_CONCURRENT_TASKS, self.bandwidth_limiter)
+		self.async_engine = AsyncDownloadEngine(self.progress_table, ASYNC_MAX_CONCURRENT_TASKS, self.bandwidth_limiter)
+		self.engine = DOWNLOAD_ENGINE
 		self.url_exception = False
-		self.ffmpeg_exists = check_ffmpeg_exists()
+		self.ffmpeg_probe = threading.Thread(target=check_ffmpeg_exists, daemon=True)
+		self.ffmpeg_probe.start()
+		self.startup_timings = {}
+		self.metadata_cache = cache.MetadataCache()
+		self.manifest_cache = cache.ManifestCache()
+		self.validation_generation = 0
+		self.validation_lock = threading.Lock()
+		self.metrics_exporter = None
 	
-	def validate_url(self, url):
-		self.url = url
-		self.url_exception = False
+	def begin_validation(self):
+		with self.validation_lock:
+			self.validation_generation += 1
+			return self.validation_generation
+			
+	def is_current_validation(self, generation):
+		return generation is None or generation == self.validation_generation
+	
+	def validate_url(self, url, generation=None):
+		video_obj, playlist_obj, resolutions_available, url_exception = self.inspect_url(url)
+		is_valid_url = video_obj is not None
+		is_playlist_url = playlist_obj is not None
+		with self.validation_lock:
+			if self.is_current_validation(generation):
+				self.url = url
+				self.url_exception = url_exception
+				self.video_obj = video_obj
+				self.playlist_obj = playlist_obj
+				self.is_valid_url = is_valid_url
+				self.is_playlist_url = is_playlist_url
+				self.resolutions_available = resolutions_available
+		return is_valid_url, is_playlist_url, resolutions_available
+		
+	def validate_urls(self, urls, max_workers=BULK_VALIDATION_WORKERS):
+		#every url gets its own summary, the single url fields the main window reads are left alone
+		with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls)))) as executor:
+			return list(executor.map(self.summarize_url, urls))
+			
+	def summarize_url(self, url):
+		video_obj, playlist_obj, resolutions_available, url_exception = self.inspect_url(url)
+		playlist_size = None
+		if playlist_obj is not None:
+			try:
+				playlist_size = len(resolve_playlist_urls(playlist_obj, self.manifest_cache))
+			except Exception:
+				url_exception = True
+		return {
+			'url':url,
+			'valid':video_obj is not None,
+			'playlist':playlist_obj is not None,
+			'playlist_size':playlist_size,
+			'resolutions':resolutions_available,
+			'exception':url_exception,
+			'video_obj':video_obj,
+			'playlist_obj':playlist_obj,
+		}
+		
+	def inspect_url(self, url):
+		url_exception = False
 		try:
-			self.video_obj = pytube.YouTube(self.url)
-			self.is_valid_url = True
-			self.resolutions_available = self.get_resolutions()
+			video_obj, resolutions_available = self.lookup_video(url)
 			try:
-				self.playlist_obj = pytube.Playlist(self.url)
-				self.is_playlist_url = True
+				playlist_obj = pytube.Playlist(url)
 			except (KeyError, http.client.InvalidURL):
-				self.is_playlist_url = False
-				self.playlist_obj = None
+				playlist_obj = None
 			except:
-				self.is_playlist_url = False
-				self.playlist_obj = None
-				self.url_exception = True							
+				playlist_obj = None
+				url_exception = True							
 		except (pytube.exceptions.RegexMatchError, http.client.InvalidURL):
-			self.is_valid_url = False
-			self.is_playlist_url = False
-			self.resolutions_available = []
-			self.video_obj = None
-			self.playlist_obj = None			
+			video_obj = None
+			playlist_obj = None
+			resolutions_available = []
 		except:
-			self.is_valid_url = False
-			self.is_playlist_url = False
-			self.resolutions_available = []
-			self.video_obj = None
-			self.playlist_obj = None
-			self.url_exception = True
-		if ('list' not in self.url) or ('radio' in self.url):
-			self.is_playlist_url = False
-			self._playlist_obj = None	
-		return self.is_valid_url, self.is_playlist_url, self.resolutions_available 
+			video_obj = None
+			playlist_obj = None
+			resolutions_available = []
+			url_exception = True
+		if ('list' not in url) or ('radio' in url):
+			playlist_obj = None
+		return video_obj, playlist_obj, resolutions_available, url_exception
+		
+	def lookup_video(self, url):
+		video_id = pytube.extract.video_id(url)
+		return self.metadata_cache.get_or_load(video_id, lambda: self.load_video(url))
+		
+	def load_video(self, url):
+		video_obj = resolve_video(url, self.manifest_cache)
+		return video_obj, self.get_resolutions(video_obj)
 	
-	def get_resolutions(self):
-		res_list = []
-		streams = self.video_obj.streams if self.ffmpeg_exists else self.video_obj.streams.filter(progressive=True)
-		for stream in streams:
-			if stream.resolution:
-				res_list.append(int(stream.resolution[:-1]))
-		res_list = list(set(res_list))
-		res_list.sort(reverse=True)
-		res_list = [str(x)+'p' for x in res_list]
-		return res_list	
-		
-	def add_task(self):
-		task = Task(self.video_obj, self.playlist_obj if self.download_entire_playlist else None, self.resolution_chosen, self.destination, self.shared_classes_obj)
-		return task
+	def get_resolutions(self, video_obj=None):
+		video_obj = video_obj or self.video_obj
+		index = streamindex.get_stream_index(video_obj)
+		resolutions = index.get_resolutions(progressive_only=not self.get_ffmpeg_exists())
+		if index.get_best('audio', False, 'mp4'):
+			resolutions += self.get_audio_resolutions()
+		return resolutions
+		
+	def get_audio_resolutions(self):
+		return get_audio_resolutions(self.get_ffmpeg_exists())
+		
+	def get_ffmpeg_exists(self):
+		self.ffmpeg_probe.join()
+		return check_ffmpeg_exists()
+		
+	def is_ffmpeg_probed(self):
+		return not self.ffmpeg_probe.is_alive()
+		
+	def record_startup_timing(self, name, seconds):
+		#written once both the window and the backend have reported in
+		self.startup_timings[name] = seconds
+		if len(self.startup_timings) == len(STARTUP_TIMINGS):
+			metrics.MetricsLog().write(dict(self.startup_timings, event='startup', started_at=time.time()))
+			
+	def add_task(self, priority=PRIORITY_NORMAL):
+		playlist_obj = self.playlist_obj if self.download_entire_playlist else None
+		return self.create_task(self.video_obj, playlist_obj, self.resolution_chosen, self.destination, priority)
+		
+	def add_tasks(self, summaries, resolution, destination, download_entire_playlist=False, priority=PRIORITY_NORMAL):
+		tasks = []
+		for summary in summaries:
+			if not summary['valid']:
+				continue
+			playlist_obj = summary['playlist_obj'] if download_entire_playlist else None
+			tasks.append(self.create_task(summary['video_obj'], playlist_obj, self.choose_resolution(resolution, summary['resolutions']), destination, priority))
+		return tasks
+		
+	def create_task(self, video_obj, playlist_obj, resolution, destination, priority=PRIORITY_NORMAL):
+		if self.engine == ENGINE_ASYNCIO:
+			return AsyncTask(video_obj, playlist_obj, resolution, destination, self.async_engine, self.playlist_workers, self.stream_connections, priority, self.task_rate_limit, self.get_ffmpeg_exists(), self.get_budget_limits())
+		return Task(video_obj, playlist_obj, resolution, destination, self.scheduler, self.playlist_workers, self.stream_connections, priority, self.task_rate_limit, self.get_ffmpeg_exists(), self.get_budget_limits())
+		
+	def get_budget_limits(self):
+		if not self.size_budget and not self.time_budget:
+			return None
+		return (self.size_budget, self.time_budget)
+		
+	def choose_resolution(self, resolution, resolutions):
+		#without ffmpeg only the progressive resolutions a video lists can be downloaded
+		if not self.get_ffmpeg_exists() and (resolution not in resolutions or resolution == 'Highest available'):
+			return resolutions[0]
+		return resolution
+		
+	def get_task_statuses(self, tasks):
+		statuses = []
+		for task, fields in zip(tasks, self.progress_table.read_many([task.shared_progress_obj for task in tasks])):
+			_, done, total, state, rate, _ = fields
+			statuses.append({
+				'state':STATE_NAMES.get(int(state), 'running'),
+				'progress':get_fields_progress(fields),
+				'done':done,
+				'total':total,
+				'rate':rate,
+				'eta':(total-done)/rate if rate > 0 and total > done else None,
+				'playlist':task.playlist_obj is not None,
+			})
+		return statuses
+		
+	def shutdown(self):
+		self.scheduler.shutdown()
+		self.async_engine.shutdown()
+		if self.metrics_exporter:
+			self.metrics_exporter.stop()
+			
+	def start_metrics_exporter(self, port=0):
+		if not self.metrics_exporter:
+			self.metrics_exporter = metrics.MetricsExporter(port)
+			self.metrics_exporter.start()
+		return self.metrics_exporter.get_url()
+		
+	def set_rate_limit(self, rate_limit):
+		self.bandwidth_limiter.set_rate(rate_limit)
+		
+	def set_max_concurrency(self, max_concurrency):
+		self.scheduler.set_max_concurrency(max_concurrency)
+		self.async_engine.set_max_concurrency(max_concurrency)
 
 	
 class TaskDownloader:
-	def __init__(self, video_obj, playlist_obj, resolution, destination, shared_progress_obj, shared_completion_status_obj):
+	def __init__(self, video_obj, playlist_obj, resolution, destination, shared_progress_obj, workers=PLAYLIST_WORKERS, connections=STREAM_CONNECTIONS, bandwidth_limiter=None, ffmpeg_exists=None, staging_directory=None, budget_limits=None):
 		self.video_obj = video_obj
 		self.playlist_obj = playlist_obj
 		self.resolution = resolution
 		self.destination = destination
+		self.workers = max(1, workers)
+		self.connections = max(1, connections)
 		self.shared_progress_obj = shared_progress_obj
-		self.shared_completion_status_obj = shared_completion_status_obj
+		self.rate_limiter = ratelimit.RateLimiter(bandwidth_limiter, shared_progress_obj.get_rate_limit)
 		self.video_obj.register_on_progress_callback(self.on_progress_callback)
-		self.video_stream_size = 0
-		self.audio_stream_size = 0
-		self.adaptive_audio_download_ongoing = False
-		self.tmp_directory = os.path.join(os.getcwd(), 'tmp')
-		self.ffmpeg_exists = check_ffmpeg_exists()
+		self.stream_sizes = {}
+		self.stream_bytes_remaining = {}
+		self.progress_lock = threading.Lock()
+		self.staging_directory = staging_directory or get_staging_directory(destination)
+		self.ffmpeg_exists = check_ffmpeg_exists() if ffmpeg_exists is None else ffmpeg_exists
+		self.streaming_mux = STREAMING_MUX and supports_streaming_mux()
+		self.audio_format = AUDIO_FORMATS.get(resolution)
+		self.budget_limits = budget_limits
+		self.budget = None
+		self.manifest_cache = cache.ManifestCache()
+		self.content_store = contentstore.ContentStore()
+		self.download_index = syncindex.DownloadIndex(self.destination)
+		self.task_id = uuid.uuid4().hex[:12]
+		self.metrics_log = metrics.MetricsLog()
+		self.stream_metrics = {}
+		self.untracked_metrics = metrics.DownloadMetrics(self.task_id, None)
+		self.video_statuses = collections.Counter()
+		self.playlist_lock = threading.Lock()
+		self.playlist_total = 0
+		self.playlist_finished = 0
+		self.staging_locks = {}
 		
-		os.makedirs(self.tmp_directory, exist_ok=True)
 		os.makedirs(self.destination, exist_ok=True)
+		os.makedirs(self.staging_directory, exist_ok=True)
 		
 	def download(self):
-		if self.playlist_obj:
-			self.download_playlist()
-		else:
-			self.download_video(self.video_obj)
-		self.shared_completion_status_obj.on_complete()	
+		self.shared_progress_obj.on_start()
+		self.budget = self.create_budget()
+		try:
+			with self.measure_task():
+				if self.playlist_obj is not None:
+					self.download_playlist()
+				else:
+					with self.measure_video(self.video_obj.video_id) as video_metrics:
+						self.download_with_refresh(self.video_obj, self.download_video, video_metrics)
+		finally:
+			self.release_staging_locks()
+		#failed videos keep their partial files for the next attempt, so this only goes once nothing is left in it
+		remove_empty_directory(self.staging_directory)
+		self.shared_progress_obj.on_complete()	
+		
+	def create_budget(self):
+		if not self.budget_limits:
+			return None
+		size, seconds = self.budget_limits
+		#playlist items download side by side, each at roughly the throughput one download got before
+		parallelism = self.workers if self.playlist_obj is not None else 1
+		return budget.DownloadBudget(size, seconds, budget.read_recent_throughput(self.metrics_log.path), parallelism)
+		
+	@contextlib.contextmanager
+	def measure_task(self):
+		started_at = time.time()
+		started = time.monotonic()
+		status = metrics.STATUS_FAILED
+		try:
+			yield
+			status = metrics.STATUS_COMPLETE
+		finally:
+			self.metrics_log.write({'event':'task', 'task':self.task_id, 'playlist':self.playlist_obj is not None, 'resolution':self.resolution, 'status':status, 'started_at':started_at, 'seconds':time.monotonic()-started, 'videos':dict(self.video_statuses)})
+			
+	@contextlib.contextmanager
+	def measure_video(self, video_id):
+		video_metrics = metrics.DownloadMetrics(self.task_id, video_id, self.resolution)
+		try:
+			yield video_metrics
+		except BaseException as e:
+			video_metrics.fail(e)
+			raise
+		finally:
+			self.finish_metrics(video_metrics)
+			
+	def finish_metrics(self, video_metrics):
+		with self.progress_lock:
+			for stream_id in video_metrics.stream_ids:
+				self.stream_metrics.pop(stream_id, None)
+			self.video_statuses[video_metrics.status] += 1
+		if video_metrics.video_id:
+			self.release_staging_locks(video_metrics.video_id)
+		if self.budget:
+			self.budget.record(video_metrics.bytes, video_metrics.durations.get('download') if video_metrics.status == metrics.STATUS_COMPLETE else None)
+		self.metrics_log.write(video_metrics.record())
+			
+	def watch_streams(self, st, video_metrics):
+		streams = list(st.values()) if isinstance(st, dict) else [st]
+		video_metrics.itags = [stream.itag for stream in streams]
+		video_metrics.stream_ids += [id(stream) for stream in streams]
+		video_metrics.on_request()
+		with self.progress_lock:
+			for stream in streams:
+				self.stream_metrics[id(stream)] = video_metrics
+				
+	def get_stream_metrics(self, st):
+		return self.stream_metrics.get(id(st)) or self.untracked_metrics
+		
+	def get_video_staging_path(self, st):
+		#one folder per video and stream selection keeps same-titled playlist items apart
+		video_metrics = self.get_stream_metrics(st)
+		if not video_metrics.video_id:
+			return self.staging_directory
+		return os.path.join(self.staging_directory, get_video_staging_name(video_metrics.video_id, video_metrics.itags))
+		
+	def get_video_staging_directory(self, st):
+		directory = self.get_video_staging_path(st)
+		if directory != self.staging_directory:
+			#another task staging the same video into this destination would write into the same .part files
+			with self.progress_lock:
+				if directory not in self.staging_locks:
+					self.staging_locks[directory] = lock_staging_directory(directory)
+		os.makedirs(directory, exist_ok=True)
+		return directory
+		
+	def release_staging_locks(self, video_id=None):
+		with self.progress_lock:
+			directories = [directory for directory in self.staging_locks if video_id is None or os.path.basename(directory).startswith(video_id + '-')]
+			locks = [(directory, self.staging_locks.pop(directory)) for directory in directories]
+		for directory, fd in locks:
+			unlock_staging_directory(directory, fd)
+		
+	def check_cancelled(self):
+		#a killed async task releases its slot while the executor still runs its blocking work, that work stops at the next chunk
+		if self.shared_progress_obj.detached:
+			raise DownloadCancelled(self.video_obj.video_id)
+			
+	def finalize_stream(self, st, staged_stream, filename):
+		self.check_cancelled()
+		output_stream = os.path.join(self.destination, filename)
+		with self.get_stream_metrics(st).timer('finalize'):
+			os.replace(staged_stream, output_stream)
+		#partial files are only dropped once the finished one is in place
+		directory = self.get_video_staging_path(st)
+		if directory != self.staging_directory:
+			shutil.rmtree(directory, ignore_errors=True)
+			self.release_staging_locks(self.get_stream_metrics(st).video_id)
+		return output_stream
 			
 	def download_playlist(self):
-		video_urls = self.playlist_obj.video_urls
-		total = len(video_urls)
-		for i,video_url in enumerate(video_urls):
+		video_urls = resolve_playlist_urls(self.playlist_obj, self.manifest_cache)
+		self.playlist_total = len(video_urls)
+		self.playlist_finished = 0
+		#resolve, download and mux run as stages joined by bounded queues, so downloads never wait on metadata or ffmpeg
+		pending = queue.Queue()
+		for video_url in video_urls:
+			pending.put(video_url)
+		resolved = queue.Queue(maxsize=PLAYLIST_PREFETCH)
+		#each finalizer drives one ffmpeg process, transcodes are cpu bound so they get one per core
+		finalize_workers = TRANSCODE_WORKERS if self.audio_format else MUX_WORKERS
+		downloaded = queue.Queue(maxsize=finalize_workers)
+		with concurrent.futures.ThreadPoolExecutor(max_workers=PLAYLIST_RESOLVE_WORKERS+self.workers+finalize_workers) as executor:
+			resolvers = [executor.submit(self.resolve_playlist_items, pending, resolved) for _ in range(PLAYLIST_RESOLVE_WORKERS)]
+			downloaders = [executor.submit(self.download_playlist_items, resolved, downloaded) for _ in range(self.workers)]
+			finalizers = [executor.submit(self.finalize_playlist_items, downloaded) for _ in range(finalize_workers)]
+			for stage, consumers, next_queue in ((resolvers, downloaders, resolved), (downloaders, finalizers, downloaded)):
+				concurrent.futures.wait(stage)
+				for _ in consumers:
+					next_queue.put(None)
+				
+	def resolve_playlist_items(self, pending, resolved):
+		while True:
 			try:
-				yt = pytube.YouTube(video_url)
-				if not self.ffmpeg_exists:
-					try:
-						stream = yt.streams.filter(progressive=True).filter(subtype='mp4').filter(resolution=self.resolution)[0]
-					except IndexError:
-						stream = yt.streams.filter(progressive=True).filter(subtype='mp4').order_by('resolution')[-1]
-					self.download_progressive_stream(stream)
-				else:
-					self.download_video(yt)
-			except:
-				pass
-			self.update_download_progress(total, total-i-1)
+				video_url = pending.get_nowait()
+			except queue.Empty:
+				return
+			item = self.resolve_playlist_item(video_url)
+			if item:
+				resolved.put(item)
+				
+	def resolve_playlist_item(self, video_url):
+		video_metrics = metrics.DownloadMetrics(self.task_id, None, self.resolution)
+		try:
+			video_metrics.video_id = pytube.extract.video_id(video_url)
+			if self.is_already_downloaded(video_url):
+				video_metrics.status = metrics.STATUS_SKIPPED
+			else:
+				with video_metrics.timer('resolve'):
+					yt = resolve_video(video_url, self.manifest_cache)
+				yt.register_on_progress_callback(self.on_progress_callback)
+				return yt, video_metrics
+		except Exception as e:
+			video_metrics.fail(e)
+		self.finish_playlist_item(video_metrics)
+		
+	def download_playlist_items(self, resolved, downloaded):
+		while True:
+			item = resolved.get()
+			if item is None:
+				return
+			yt, video_metrics = item
+			try:
+				mux_job = self.download_with_refresh(yt, self.download_playlist_video, video_metrics)
+			except Exception as e:
+				video_metrics.fail(e)
+				mux_job = None
+			if mux_job:
+				downloaded.put(mux_job)
+			else:
+				self.finish_playlist_item(video_metrics)
+				
+	def finalize_playlist_items(self, downloaded):
+		while True:
+			job = downloaded.get()
+			if job is None:
+				return
+			yt, st, video_metrics, finalize = job
+			try:
+				self.record_download(yt, st, finalize())
+			except Exception as e:
+				video_metrics.fail(e)
+			self.finish_playlist_item(video_metrics)
+			
+	def finish_playlist_item(self, video_metrics):
+		self.finish_metrics(video_metrics)
+		with self.playlist_lock:
+			self.playlist_finished += 1
+			self.update_download_progress(self.playlist_total, self.playlist_total-self.playlist_finished)
+	
+	def download_playlist_video(self, yt, video_metrics):
+		with video_metrics.timer('select'):
+			st = self.select_playlist_video_stream(yt)
+		restored_path = self.restore_download(yt, st, video_metrics)
+		if restored_path:
+			self.record_download(yt, st, restored_path)
+			return None
+		if isinstance(st, dict):
+			#hand the mux to the finalize stage and free this downloader for the next item
+			self.watch_streams(st, video_metrics)
+			with video_metrics.timer('download'):
+				video_stream, audio_stream = self.download_adaptive_inputs(st)
+			return yt, st, video_metrics, functools.partial(self.mux_adaptive_stream, st, video_stream, audio_stream)
+		if self.audio_format:
+			self.watch_streams(st, video_metrics)
+			with video_metrics.timer('download'):
+				audio_stream = self.download_audio_input(st)
+			return yt, st, video_metrics, functools.partial(self.convert_audio_stream, st, audio_stream)
+		self.record_download(yt, st, self.download_selected_stream(st, video_metrics))
+		
+	def is_already_downloaded(self, video_url):
+		return self.download_index.is_complete(pytube.extract.video_id(video_url), self.resolution)
+		
+	def record_download(self, yt, st, path):
+		streams = list(st.values()) if isinstance(st, dict) else [st]
+		self.download_index.record(yt.video_id, self.resolution, [stream.itag for stream in streams], path, yt.title)
+		if self.content_store:
+			try:
+				self.content_store.put(self.get_content_key(yt, st), path)
+			except Exception as e:
+				#the file already is in the destination, a store that cannot take it only costs the next destination a download
+				self.log_content_store_error(yt, 'put', e)
+				
+	def log_content_store_error(self, yt, action, error):
+		self.metrics_log.write({'event':'content_store', 'task':self.task_id, 'video_id':yt.video_id, 'action':action, 'error':'{}: {}'.format(type(error).__name__, error)})
+			
+	def get_content_key(self, yt, st):
+		streams = list(st.values()) if isinstance(st, dict) else [st]
+		return self.content_store.get_key(yt.video_id, [stream.itag for stream in streams], os.path.splitext(self.get_output_filename(st))[1])
+		
+	def get_output_filename(self, st):
+		if isinstance(st, dict):
+			return st['video'].default_filename
+		if self.audio_format:
+			return os.path.splitext(st.default_filename)[0] + '.' + self.audio_format
+		return st.default_filename
+		
+	def restore_download(self, yt, st, video_metrics):
+		#the same video and streams fetched for another destination are linked in without touching the network or ffmpeg
+		if not self.content_store:
+			return None
+		self.watch_streams(st, video_metrics)
+		stream = st['video'] if isinstance(st, dict) else st
+		key = self.get_content_key(yt, st)
+		staged_path = os.path.join(self.get_video_staging_directory(stream), key)
+		try:
+			with video_metrics.timer('restore'):
+				if not self.content_store.restore(key, staged_path):
+					return None
+		except Exception as e:
+			self.log_content_store_error(yt, 'restore', e)
+			return None
+		return self.finalize_stream(stream, staged_path, self.get_output_filename(st))
+		
+	def select_playlist_video_stream(self, yt):
+		if self.audio_format:
+			return self.select_audio_stream(yt)
+		if self.budget:
+			return self.select_budget_stream(yt)
+		if not self.ffmpeg_exists:
+			return streamindex.get_stream_index(yt).get('video', True, 'mp4', self.resolution) or self.get_highest_resolution_progressive_stream(yt)
+		return self.select_video_stream(yt)
+			
+	def download_with_refresh(self, yt, download, video_metrics):
+		try:
+			return download(yt, video_metrics)
+		except urllib.error.HTTPError as e:
+			if e.code != 403:
+				raise
+			#signed stream urls went stale, drop the cached manifest and resolve again
+			video_metrics.retries += 1
+			self.manifest_cache.invalidate(yt.video_id)
+			with video_metrics.timer('resolve'):
+				yt = pytube.YouTube(yt.watch_url)
+			yt.register_on_progress_callback(self.on_progress_callback)
+			self.manifest_cache.put_video(yt)
+			return download(yt, video_metrics)
 	
-	def download_video(self, yt):
+	def download_video(self, yt, video_metrics):
+		with video_metrics.timer('select'):
+			st = self.select_video_stream(yt)
+		self.record_download(yt, st, self.restore_download(yt, st, video_metrics) or self.download_selected_stream(st, video_metrics))
+		
+	def download_selected_stream(self, st, video_metrics):
+		self.watch_streams(st, video_metrics)
+		with video_metrics.timer('download'):
+			if isinstance(st, dict):
+				return self.download_adaptive_stream(st)
+			if self.audio_format:
+				return self.download_audio_stream(st)
+			return self.download_progressive_stream(st)
+		
+	def select_video_stream(self, yt):
+		if self.audio_format:
+			return self.select_audio_stream(yt)
+		if self.budget:
+			return self.select_budget_stream(yt)
 		if self.resolution == 'Highest available':
-			self.download_highest_resolution_stream(yt)
-		else:
-			self.download_this_resolution_stream(yt, self.resolution)
+			return self.select_highest_resolution_stream(yt)
+		return self.select_this_resolution_stream(yt, self.resolution)
 			
-	def download_highest_resolution_stream(self, yt):
+	def select_highest_resolution_stream(self, yt):
 		hrps = self.get_highest_resolution_progressive_stream(yt)
 		hras = self.get_highest_resolution_adaptive_stream(yt)
 		if self.compare_resolutions(hrps, hras['video']) >= 0:
-			self.download_progressive_stream(hrps)
-		else:
-			self.download_adaptive_stream(hras)
+			return hrps
+		return hras
 			
-	def download_this_resolution_stream(self, yt, res):
-		try:
-			stream = yt.streams.filter(subtype='mp4').filter(progressive=True).filter(resolution=res)[0]
-			self.download_progressive_stream(stream)
-		except IndexError:
-			try:
-				video_stream = yt.streams.filter(type='video').filter(subtype='mp4').filter(adaptive=True).filter(resolution=res)[0]
-				audio_stream = yt.streams.filter(type='audio').filter(subtype='mp4').order_by('abr')[-1]	
-				stream = {'video':video_stream, 'audio':audio_stream}
-				self.download_adaptive_stream(stream)			
-			except IndexError:
-				self.download_highest_resolution_stream(yt)
+	def select_budget_stream(self, yt):
+		#items still downloading count as left, their bytes are not spent yet
+		items_left = self.playlist_total - self.playlist_finished if self.playlist_obj is not None else 1
+		max_quality = streamindex.quality(self.resolution) if self.resolution[:-1].isdigit() else None
+		st = streamindex.get_stream_index(yt).get_best_within(self.budget.get_allowance(items_left), self.ffmpeg_exists, max_quality)
+		if not st:
+			raise IndexError('No mp4 stream')
+		return st
+		
+	def select_audio_stream(self, yt):
+		st = streamindex.get_stream_index(yt).get_best('audio', False, 'mp4')
+		if not st:
+			raise IndexError('No mp4 audio stream')
+		return st
+		
+	def select_this_resolution_stream(self, yt, res):
+		index = streamindex.get_stream_index(yt)
+		progressive_stream = index.get('video', True, 'mp4', res)
+		if progressive_stream:
+			return progressive_stream
+		video_stream = index.get('video', False, 'mp4', res)
+		audio_stream = index.get_best('audio', False, 'mp4')
+		if video_stream and audio_stream:
+			return {'video':video_stream, 'audio':audio_stream}
+		return self.select_highest_resolution_stream(yt)
 				
 	def download_progressive_stream(self, st):
-		self.video_stream_size = st.filesize
-		self.audio_stream_size = 0
-		st.download(self.destination, skip_existing=False)
+		self.track_streams(st)
+		return self.finalize_stream(st, self.download_stream(st, self.get_video_staging_directory(st)), st.default_filename)
+		
+	def download_audio_stream(self, st):
+		return self.convert_audio_stream(st, self.download_audio_input(st))
+		
+	def download_audio_input(self, st):
+		self.track_streams(st)
+		return self.download_stream(st, self.get_video_staging_directory(st), "audio-")
+		
+	def convert_audio_stream(self, st, audio_stream):
+		filename = self.get_output_filename(st)
+		if self.audio_format == 'm4a' and not self.ffmpeg_exists:
+			#the mp4 audio stream already is an m4a file, without ffmpeg it only needs the right name
+			return self.finalize_stream(st, audio_stream, filename)
+		output_stream = os.path.join(self.get_video_staging_directory(st), filename)
+		with self.get_stream_metrics(st).timer('transcode'):
+			call_ffmpeg_audio(audio_stream, output_stream, self.audio_format)
+		os.remove(audio_stream)
+		return self.finalize_stream(st, output_stream, filename)
 		
 	def download_adaptive_stream(self, st):
-		self.video_stream_size = st['video'].filesize
-		self.audio_stream_size = st['audio'].filesize
-		st['video'].download(filename_prefix="video-", output_path=self.tmp_directory, skip_existing=False)
-		self.adaptive_audio_download_ongoing = True
-		st['audio'].download(filename_prefix="audio-", output_path=self.tmp_directory, skip_existing=False)
-		self.adaptive_audio_download_ongoing = False
-		video_stream = os.path.join(self.tmp_directory, "video-"+st['video'].default_filename)
-		audio_stream = os.path.join(self.tmp_directory, "audio-"+st['audio'].default_filename)
-		output_stream = os.path.join(self.tmp_directory, st['video'].default_filename)
-		call_ffmpeg(video_stream, audio_stream, output_stream)
+		video_metrics = self.get_stream_metrics(st['video'])
+		if self.streaming_mux:
+			try:
+				return self.stream_adaptive_stream(st)
+			except (segmented.RangeNotSupported, segmented.RemoteChanged, subprocess.CalledProcessError, BrokenPipeError):
+				pass
+			except urllib.error.HTTPError as e:
+				if e.code != 404:
+					raise
+			video_metrics.fallbacks += 1
+		video_stream, audio_stream = self.download_adaptive_inputs(st)
+		return self.mux_adaptive_stream(st, video_stream, audio_stream)
+		
+	def download_adaptive_inputs(self, st):
+		self.track_streams(st['video'], st['audio'])
+		with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+			video_future = executor.submit(self.download_stream, st['video'], self.get_video_staging_directory(st['video']), "video-")
+			audio_future = executor.submit(self.download_stream, st['audio'], self.get_video_staging_directory(st['audio']), "audio-")
+			return video_future.result(), audio_future.result()
+			
+	def mux_adaptive_stream(self, st, video_stream, audio_stream):
+		video_metrics = self.get_stream_metrics(st['video'])
+		output_stream = os.path.join(self.get_video_staging_directory(st['video']), st['video'].default_filename)
+		with video_metrics.timer('mux'):
+			call_ffmpeg(video_stream, audio_stream, output_stream)
 		os.remove(video_stream)
 		os.remove(audio_stream)
-		src_shutil = output_stream
-		dest_shutil = os.path.join(self.destination, st['video'].default_filename)
-		shutil.move(src_shutil, dest_shutil)
+		return self.finalize_stream(st['video'], output_stream, st['video'].default_filename)
+		
+	def stream_adaptive_stream(self, st):
+		self.track_streams(st['video'], st['audio'])
+		part_stream = os.path.join(self.get_video_staging_directory(st['video']), st['video'].default_filename + segmented.PART_SUFFIX)
+		process, video_pipe, audio_pipe = open_ffmpeg_pipes(part_stream, st['video'].subtype)
+		try:
+			with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+				futures = [executor.submit(self.pipe_stream, st['video'], video_pipe), executor.submit(self.pipe_stream, st['audio'], audio_pipe)]
+				done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+				if any(future.exception() for future in done):
+					#unblock the other writer by taking the pipes' reader away
+					process.kill()
+				for future in futures:
+					future.result()
+			#ffmpeg muxes as the bytes arrive, this is only the tail after the last write
+			with self.get_stream_metrics(st['video']).timer('mux'):
+				returncode = process.wait()
+			if returncode:
+				raise subprocess.CalledProcessError(process.returncode, process.args)
+		except:
+			process.kill()
+			process.wait()
+			if os.path.exists(part_stream):
+				os.remove(part_stream)
+			raise
+		return self.finalize_stream(st['video'], part_stream, st['video'].default_filename)
+		
+	def pipe_stream(self, st, pipe):
+		with pipe:
+			streamer = segmented.RangeStreamer(st.url, st.filesize, pipe.write, self.connections, lambda chunk, bytes_remaining: self.on_progress_callback(st, chunk, bytes_remaining))
+			streamer.stream()
+		
+	def download_stream(self, st, output_path, filename_prefix=None):
+		file_path = st.get_file_path(filename=None, output_path=output_path, filename_prefix=filename_prefix)
+		downloader = segmented.SegmentedDownloader(st.url, st.filesize, file_path, self.connections, lambda chunk, bytes_remaining: self.on_progress_callback(st, chunk, bytes_remaining))
+		try:
+			return downloader.download()
+		except segmented.RangeNotSupported:
+			pass
+		except segmented.RemoteChanged:
+			downloader.discard()
+		except urllib.error.HTTPError as e:
+			if e.code != 404:
+				raise
+		self.get_stream_metrics(st).fallbacks += 1
+		return st.download(output_path=output_path, filename_prefix=filename_prefix, skip_existing=False)
+		
+	def track_streams(self, *streams):
+		stream_sizes = {st.itag:st.filesize for st in streams}
+		with self.progress_lock:
+			self.stream_sizes = stream_sizes
+			self.stream_bytes_remaining = dict(stream_sizes)
 
 	def on_progress_callback(self, stream, chunk, bytes_remaining):
-		total = self.video_stream_size + self.audio_stream_size
-		if self.adaptive_audio_download_ongoing:
-			remaining = bytes_remaining
-		else:
-			remaining = self.audio_stream_size + bytes_remaining
+		self.check_cancelled()
+		self.rate_limiter.consume(len(chunk))
+		self.get_stream_metrics(stream).on_chunk(len(chunk))
+		self.record_progress(stream, bytes_remaining)
+		
+	def record_progress(self, stream, bytes_remaining):
+		if self.playlist_obj is not None:
+			return
+		with self.progress_lock:
+			if stream.itag not in self.stream_bytes_remaining:
+				return
+			self.stream_bytes_remaining[stream.itag] = bytes_remaining
+			total = sum(self.stream_sizes.values())
+			remaining = sum(self.stream_bytes_remaining.values())
 		self.update_download_progress(total, remaining)		
 	
 	def update_download_progress(self, total, remaining):
-		percentage_completed = ((total-remaining)/total) * 100
-		self.shared_progress_obj.update_progress(percentage_completed)
+		self.shared_progress_obj.update_progress(total-remaining, total)
 	
 	def compare_resolutions(self, st1, st2):
 		return (int(st1.resolution[:-1])-(int(st2.resolution[:-1])))
 	
 	def get_highest_resolution_progressive_stream(self, yt):
-		return yt.streams.filter(subtype='mp4').filter(progressive=True).order_by('resolution')[-1]
+		st = streamindex.get_stream_index(yt).get_best('video', True, 'mp4')
+		if not st:
+			raise IndexError('No progressive mp4 stream')
+		return st
 	
 	def get_highest_resolution_adaptive_stream(self, yt):
-		video_stream = yt.streams.filter(type="video").filter(adaptive=True).filter(subtype='mp4').order_by('resolution')[-1]
-		audio_stream = yt.streams.filter(type="audio").filter(subtype='mp4').order_by('abr')[-1]
+		index = streamindex.get_stream_index(yt)
+		video_stream = index.get_best('video', False, 'mp4')
+		audio_stream = index.get_best('audio', False, 'mp4')
+		if not video_stream or not audio_stream:
+			raise IndexError('No adaptive mp4 streams')
 		hras = {'video':video_stream, 'audio':audio_stream}
-		return hras		
-	
+		return hras
 
-	
 
+class AsyncTaskDownloader(TaskDownloader):
+	async def download_async(self):
+		self.shared_progress_obj.on_start()
+		self.budget = await self.run_blocking(self.create_budget)
+		try:
+			with self.measure_task():
+				if self.playlist_obj is not None:
+					await self.download_playlist_async()
+				else:
+					with self.measure_video(self.video_obj.video_id) as video_metrics:
+						await self.download_with_refresh_async(self.video_obj, self.download_video_async, video_metrics)
+		finally:
+			self.release_staging_locks()
+		remove_empty_directory(self.staging_directory)
+		self.shared_progress_obj.on_complete()
 		
-
+	async def run_blocking(self, func, *args):
+		return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+		
+	async def download_playlist_async(self):
+		video_urls = await self.run_blocking(resolve_playlist_urls, self.playlist_obj, self.manifest_cache)
+		self.playlist_total = len(video_urls)
+		self.playlist_finished = 0
+		semaphore = asyncio.Semaphore(self.workers)
+		await asyncio.gather(*(self.download_playlist_item_async(video_url, semaphore) for video_url in video_urls))
+		
+	async def download_playlist_item_async(self, video_url, semaphore):
+		async with semaphore:
+			try:
+				with self.measure_video(pytube.extract.video_id(video_url)) as video_metrics:
+					if await self.run_blocking(self.is_already_downloaded, video_url):
+						video_metrics.status = metrics.STATUS_SKIPPED
+					else:
+						with video_metrics.timer('resolve'):
+							yt = await self.run_blocking(resolve_video, video_url, self.manifest_cache)
+						yt.register_on_progress_callback(self.on_progress_callback)
+						await self.download_with_refresh_async(yt, self.download_playlist_video_async, video_metrics)
+			except asyncio.CancelledError:
+				raise
+			except Exception:
+				pass
+			self.playlist_finished += 1
+			self.update_download_progress(self.playlist_total, self.playlist_total-self.playlist_finished)
 			
-
+	async def download_with_refresh_async(self, yt, download, video_metrics):
+		try:
+			await download(yt, video_metrics)
+		except urllib.error.HTTPError as e:
+			if e.code != 403:
+				raise
+			video_metrics.retries += 1
+			self.manifest_cache.invalidate(yt.video_id)
+			with video_metrics.timer('resolve'):
+				yt = await self.run_blocking(pytube.YouTube, yt.watch_url)
+			yt.register_on_progress_callback(self.on_progress_callback)
+			self.manifest_cache.put_video(yt)
+			await download(yt, video_metrics)
+			
+	async def download_playlist_video_async(self, yt, video_metrics):
+		with video_metrics.timer('select'):
+			st = await self.run_blocking(self.select_playlist_video_stream, yt)
+		path = await self.run_blocking(self.restore_download, yt, st, video_metrics) or await self.download_selected_stream_async(st, video_metrics)
+		await self.run_blocking(self.record_download, yt, st, path)
+			
+	async def download_video_async(self, yt, video_metrics):
+		with video_metrics.timer('select'):
+			st = await self.run_blocking(self.select_video_stream, yt)
+		path = await self.run_blocking(self.restore_download, yt, st, video_metrics) or await self.download_selected_stream_async(st, video_metrics)
+		await self.run_blocking(self.record_download, yt, st, path)
 		
-
+	async def download_selected_stream_async(self, st, video_metrics):
+		self.watch_streams(st, video_metrics)
+		with video_metrics.timer('download'):
+			if isinstance(st, dict):
+				await self.run_blocking(self.track_streams, st['video'], st['audio'])
+				staging_directory = self.get_video_staging_directory(st['video'])
+				video_stream, audio_stream = await asyncio.gather(self.download_stream_async(st['video'], staging_directory, "video-"), self.download_stream_async(st['audio'], staging_directory, "audio-"))
+				output_stream = os.path.join(staging_directory, st['video'].default_filename)
+				with video_metrics.timer('mux'):
+					await self.call_ffmpeg_async(video_stream, audio_stream, output_stream)
+				os.remove(video_stream)
+				os.remove(audio_stream)
+				return self.finalize_stream(st['video'], output_stream, st['video'].default_filename)
+			await self.run_blocking(self.track_streams, st)
+			if self.audio_format:
+				audio_stream = await self.download_stream_async(st, self.get_video_staging_directory(st), "audio-")
+				return await self.run_blocking(self.convert_audio_stream, st, audio_stream)
+			return self.finalize_stream(st, await self.download_stream_async(st, self.get_video_staging_directory(st)), st.default_filename)
+			
+	async def download_stream_async(self, st, output_path, filename_prefix=None):
+		file_path = st.get_file_path(filename=None, output_path=output_path, filename_prefix=filename_prefix)
+		video_metrics = self.get_stream_metrics(st)
+		async def on_chunk(chunk):
+			await asyncio.sleep(self.rate_limiter.reserve(len(chunk)))
+			video_metrics.on_chunk(len(chunk))
+			with self.progress_lock:
+				bytes_remaining = self.stream_bytes_remaining.get(st.itag, 0) - len(chunk)
+			self.record_progress(st, bytes_remaining)
+		try:
+			return await aioengine.download(st.url, st.filesize, file_path, self.connections, on_chunk)
+		except (segmented.RangeNotSupported, segmented.RemoteChanged):
+			pass
+		except urllib.error.HTTPError as e:
+			if e.code != 404:
+				raise
+		video_metrics.fallbacks += 1
+		return await self.run_blocking(functools.partial(st.download, output_path=output_path, filename_prefix=filename_prefix, skip_existing=False))
+		
+	async def call_ffmpeg_async(self, video_stream, audio_stream, output_stream):
+		kwargs = {'creationflags':subprocess.CREATE_NO_WINDOW} if platform.system()=='Windows' else {}
+		process = await asyncio.create_subprocess_exec('ffmpeg', '-y', '-i', video_stream, '-i', audio_stream, '-c', 'copy', output_stream, stdin=subprocess.DEVNULL, **kwargs)
+		try:
+			await process.wait()
+		except asyncio.CancelledError:
+			process.kill()
+			raise
@@ -0,0 +1,462 @@
+import argparse
+import http.server
+import statistics
+import subprocess
+import threading
+import itertools
+import platform
+import tempfile
+import random
+import hashlib
+import shutil
+import json
+import time
+import sys
+import os
+import re
+import pytube
+import segmented
+import httppool
+import backend
+import metrics
+import cache
+import contentstore
+
+
+PROGRESSIVE_SIZE = 32*1024*1024
+PLAYLIST_ITEM_SIZE = 1024*1024
+PLAYLIST_LENGTHS = (1, 10, 100)
+CONNECTION_REUSE_VIDEOS = 50
+PROGRESS_CALLBACKS = 100000
+FIXTURE_SECONDS = 10
+REPEATS = 3
+SEED = 1
+SEND_CHUNK_SIZE = 65536
+
+#itags pytube has format profiles for: 720p and 360p progressive, 1080p video only and 128kbps audio only, all mp4
+PROGRESSIVE_720P = (22, 'video/mp4; codecs="avc1.64001F, mp4a.40.2"')
+PROGRESSIVE_360P = (18, 'video/mp4; codecs="avc1.42001E, mp4a.40.2"')
+ADAPTIVE_1080P = (137, 'video/mp4; codecs="avc1.640028"')
+ADAPTIVE_AUDIO = (140, 'audio/mp4; codecs="mp4a.40.2"')
+
+
+class FakeCDNHandler(http.server.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	#headers and body go out as separate writes, with nagle a reused connection stalls on the client's delayed ack
+	disable_nagle_algorithm = True
+
+	def log_message(self, format, *args):
+		pass
+
+	def setup(self):
+		super().setup()
+		self.server.cdn.count('connections')
+		if self.server.cdn.handshake_latency:
+			#stands in for the tcp and tls round trips a real cdn costs on every new connection
+			time.sleep(self.server.cdn.handshake_latency)
+
+	def do_HEAD(self):
+		self.respond(send_body=False)
+
+	def do_GET(self):
+		self.respond()
+
+	def respond(self, send_body=True):
+		cdn = self.server.cdn
+		cdn.count('requests')
+		data = cdn.resources.get(self.path.partition('?')[0])
+		if data is None:
+			self.send_error(404)
+			return
+		if cdn.latency:
+			time.sleep(cdn.latency)
+		start, end = 0, len(data)-1
+		match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+		if match and cdn.ranges:
+			start = int(match.group(1))
+			end = min(int(match.group(2)), end) if match.group(2) else end
+			self.send_response(206)
+			self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+		else:
+			self.send_response(200)
+		self.send_header('Content-Type', 'application/octet-stream')
+		self.send_header('Content-Length', str(end-start+1))
+		self.end_headers()
+		if send_body:
+			try:
+				cdn.send(self.wfile, memoryview(data)[start:end+1])
+			except (BrokenPipeError, ConnectionResetError):
+				self.close_connection = True
+
+
+class FakeCDN:
+	def __init__(self, latency=0, bandwidth=0, ranges=True, handshake_latency=0):
+		self.latency = latency
+		self.handshake_latency = handshake_latency
+		self.bandwidth = bandwidth
+		self.ranges = ranges
+		self.resources = {}
+		self.counters = {'connections':0, 'requests':0}
+		self.lock = threading.Lock()
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FakeCDNHandler)
+		self.server.daemon_threads = True
+		self.server.cdn = self
+
+	def start(self):
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def add(self, name, data):
+		path = '/' + name
+		self.resources[path] = data
+		return 'http://{}:{}{}'.format(self.server.server_address[0], self.server.server_address[1], path)
+
+	def count(self, name):
+		with self.lock:
+			self.counters[name] += 1
+
+	def reset_counters(self):
+		with self.lock:
+			counters = self.counters
+			self.counters = dict.fromkeys(counters, 0)
+		return counters
+
+	def send(self, wfile, view):
+		started = time.monotonic()
+		for offset in range(0, len(view), SEND_CHUNK_SIZE):
+			chunk = view[offset:offset+SEND_CHUNK_SIZE]
+			wfile.write(chunk)
+			if self.bandwidth:
+				#every connection is capped on its own, like a cdn edge throttling per socket
+				delay = (offset+len(chunk))/self.bandwidth - (time.monotonic()-started)
+				if delay > 0:
+					time.sleep(delay)
+
+
+class FakePlaylist:
+	def __init__(self, playlist_id, videos):
+		self.playlist_id = playlist_id
+		self.video_urls = [yt.watch_url for yt in videos]
+
+
+def synthetic_data(size, seed=SEED):
+	return random.Random(seed).randbytes(size)
+
+
+def fake_video(cdn, video_id, title, formats):
+	streams = []
+	for (itag, mime_type), data in formats:
+		url = cdn.add('{}/{}'.format(video_id, itag), data)
+		raw = {'url':url, 'itag':itag, 'type':mime_type, 'is_otf':False, 'bitrate':None, 'fps':None if mime_type.startswith('audio') else 30}
+		streams.append((raw, len(data)))
+	return cache.hydrate_video(video_id, title, FIXTURE_SECONDS, streams)
+
+
+def fake_video_id(number):
+	return 'bench{:06d}'.format(number)
+
+
+def create_media_fixtures(directory):
+	#real media so ffmpeg has something it can mux, faststart keeps the moov atom readable from a pipe
+	video_file = os.path.join(directory, 'fixture-video.mp4')
+	audio_file = os.path.join(directory, 'fixture-audio.mp4')
+	subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'testsrc=duration={}:size=1920x1080:rate=30'.format(FIXTURE_SECONDS), '-c:v', 'libx264', '-preset', 'ultrafast', '-movflags', '+faststart', '-an', video_file], stdin=subprocess.DEVNULL, check=True)
+	subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', 'sine=duration={}'.format(FIXTURE_SECONDS), '-c:a', 'aac', '-movflags', '+faststart', '-vn', audio_file], stdin=subprocess.DEVNULL, check=True)
+	return video_file, audio_file
+
+
+def file_digest(path):
+	digest = hashlib.sha256()
+	with open(path, 'rb') as fh:
+		for block in iter(lambda: fh.read(1048576), b''):
+			digest.update(block)
+	return digest.hexdigest()
+
+
+def destination_digests(destination):
+	return sorted(file_digest(entry.path) for entry in os.scandir(destination) if entry.is_file() and not entry.name.startswith('.'))
+
+
+def git_revision():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+class Benchmark:
+	def __init__(self, cdn, workspace, repeats=REPEATS):
+		self.cdn = cdn
+		self.workspace = workspace
+		self.repeats = max(1, repeats)
+		self.manifest_cache = cache.ManifestCache(os.path.join(workspace, 'manifest-cache.sqlite3'))
+		self.metrics_log = metrics.MetricsLog(os.path.join(workspace, 'metrics.jsonl'))
+		self.progress_table = backend.ProgressTable()
+		self.ffmpeg_exists = backend.check_ffmpeg_exists()
+		self.media_fixtures = None
+		self.video_ids = itertools.count()
+		self.run_ids = itertools.count()
+		self.results = []
+
+	def measure(self, name, params, size, prepare):
+		timings = []
+		self.cdn.reset_counters()
+		try:
+			for _ in range(self.repeats):
+				run, cleanup = prepare()
+				try:
+					started = time.perf_counter()
+					check = run()
+					timings.append(time.perf_counter()-started)
+					#verifying the output is left out of the timing
+					if check:
+						check()
+				finally:
+					cleanup()
+		except Exception as e:
+			self.cdn.reset_counters()
+			self.results.append({'name':name, 'params':params, 'error':'{}: {}'.format(type(e).__name__, e)})
+			return None
+		counters = self.cdn.reset_counters()
+		median = statistics.median(timings)
+		result = {
+			'name':name,
+			'params':params,
+			'runs':timings,
+			'median_seconds':median,
+			'min_seconds':min(timings),
+			'bytes':size,
+			'throughput_bps':size/median if size and median else None,
+			'requests':counters['requests']/self.repeats,
+			'connections':counters['connections']/self.repeats,
+		}
+		self.results.append(result)
+		return result
+
+	def skip(self, name, params, reason):
+		self.results.append({'name':name, 'params':params, 'skipped':reason})
+
+	def add_video(self, formats):
+		video_id = fake_video_id(next(self.video_ids))
+		yt = fake_video(self.cdn, video_id, 'Benchmark video {}'.format(video_id), formats)
+		self.manifest_cache.put_video(yt)
+		return yt
+
+	def download_case(self, video_obj, playlist_obj, resolution, connections, expected_files=None, workers=backend.PLAYLIST_WORKERS, record_progress=True, content_store=None):
+		#the part file is preallocated to full size, so only the content shows dropped or zero-filled ranges
+		expected_digests = sorted(hashlib.sha256(data).hexdigest() for data in expected_files) if expected_files is not None else None
+		def prepare():
+			destination = os.path.join(self.workspace, 'run-{}'.format(next(self.run_ids)))
+			shared_progress_obj = self.progress_table.allocate()
+			downloader = backend.TaskDownloader(video_obj, playlist_obj, resolution, destination, shared_progress_obj, workers, connections)
+			downloader.manifest_cache = self.manifest_cache
+			downloader.metrics_log = self.metrics_log
+			#repeats must download again, not link in what the first run stored
+			downloader.content_store = content_store
+			if not record_progress:
+				downloader.record_progress = lambda stream, bytes_remaining: None
+			def run():
+				downloader.download()
+				return check
+			def check():
+				#playlist items swallow their own errors, so the destination is the only sign a run failed
+				digests = destination_digests(destination)
+				if not digests or (expected_digests is not None and digests != expected_digests):
+					raise RuntimeError('{} files downloaded, {} of {} expected ones match the source'.format(len(digests), len(set(digests) & set(expected_digests or [])), len(expected_digests or [])))
+			def cleanup():
+				self.progress_table.release(shared_progress_obj)
+				shutil.rmtree(destination, ignore_errors=True)
+			return run, cleanup
+		return prepare
+
+	def run_progressive(self, size):
+		data = synthetic_data(size)
+		yt = self.add_video([(PROGRESSIVE_720P, data)])
+		for connections in sorted({1, backend.STREAM_CONNECTIONS}):
+			self.measure('progressive_throughput', {'connections':connections}, size, self.download_case(yt, None, '720p', connections, [data]))
+		self.measure('progressive_throughput_without_progress', {'connections':backend.STREAM_CONNECTIONS}, size, self.download_case(yt, None, '720p', backend.STREAM_CONNECTIONS, [data], record_progress=False))
+
+	def run_adaptive(self):
+		params = {'connections':backend.STREAM_CONNECTIONS, 'streaming_mux':backend.STREAMING_MUX and backend.supports_streaming_mux()}
+		if not self.ffmpeg_exists:
+			self.skip('adaptive_throughput', params, 'ffmpeg not found')
+			return
+		try:
+			video_file, audio_file = self.get_media_fixtures()
+		except (OSError, subprocess.CalledProcessError) as e:
+			self.skip('adaptive_throughput', params, 'no media fixtures: {}'.format(e))
+			return
+		with open(video_file, 'rb') as fh:
+			video_data = fh.read()
+		with open(audio_file, 'rb') as fh:
+			audio_data = fh.read()
+		yt = self.add_video([(PROGRESSIVE_360P, synthetic_data(PLAYLIST_ITEM_SIZE)), (ADAPTIVE_1080P, video_data), (ADAPTIVE_AUDIO, audio_data)])
+		self.measure('adaptive_throughput', params, len(video_data)+len(audio_data), self.download_case(yt, None, '1080p', backend.STREAM_CONNECTIONS))
+
+	def run_mux(self):
+		if not self.ffmpeg_exists:
+			self.skip('mux', {}, 'ffmpeg not found')
+			return
+		try:
+			video_file, audio_file = self.get_media_fixtures()
+		except (OSError, subprocess.CalledProcessError) as e:
+			self.skip('mux', {}, 'no media fixtures: {}'.format(e))
+			return
+		def prepare():
+			output_file = os.path.join(self.workspace, 'mux-{}.mp4'.format(next(self.run_ids)))
+			return lambda: backend.call_ffmpeg(video_file, audio_file, output_file), lambda: os.path.exists(output_file) and os.remove(output_file)
+		self.measure('mux', {'seconds_of_media':FIXTURE_SECONDS}, os.path.getsize(video_file)+os.path.getsize(audio_file), prepare)
+
+	def run_progress_callbacks(self, calls=PROGRESS_CALLBACKS):
+		yt = self.add_video([(PROGRESSIVE_720P, b'\0')])
+		st = yt.streams.get_by_itag(PROGRESSIVE_720P[0])
+		chunk = bytes(segmented.CHUNK_SIZE)
+		def update_progress():
+			shared_progress_obj = self.progress_table.allocate()
+			def run():
+				for done in range(calls):
+					shared_progress_obj.update_progress(done, calls)
+			return run, lambda: self.progress_table.release(shared_progress_obj)
+		def on_progress_callback():
+			shared_progress_obj = self.progress_table.allocate()
+			downloader = backend.TaskDownloader(yt, None, '720p', os.path.join(self.workspace, 'callbacks'), shared_progress_obj)
+			downloader.track_streams(st)
+			def run():
+				for done in range(calls):
+					downloader.on_progress_callback(st, chunk, calls-done)
+			return run, lambda: self.progress_table.release(shared_progress_obj)
+		for name, prepare in (('shared_progress_update', update_progress), ('progress_callback', on_progress_callback)):
+			result = self.measure(name, {'calls':calls}, 0, prepare)
+			if result:
+				result['ns_per_call'] = result['median_seconds']/calls*1e9
+
+	def run_startup(self):
+		#a fresh interpreter each run, so the import cost is measured cold as the app sees it
+		command = [sys.executable, '-c', 'import backend; backend.YTD().shutdown()']
+		def run():
+			subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+		self.measure('backend_startup', {}, 0, lambda: (run, lambda: None))
+
+	def run_playlists(self, lengths, item_size):
+		for length in lengths:
+			items = [synthetic_data(item_size, SEED+i) for i in range(length)]
+			videos = [self.add_video([(PROGRESSIVE_360P, data)]) for data in items]
+			playlist_obj = FakePlaylist('benchmark-playlist-{}'.format(length), videos)
+			params = {'videos':length, 'workers':backend.PLAYLIST_WORKERS, 'connections':backend.STREAM_CONNECTIONS}
+			self.measure('playlist', params, item_size*length, self.download_case(videos[0], playlist_obj, '360p', backend.STREAM_CONNECTIONS, items))
+
+	def run_connection_reuse(self, length, item_size):
+		items = [synthetic_data(item_size, SEED+i) for i in range(length)]
+		videos = [self.add_video([(PROGRESSIVE_360P, data)]) for data in items]
+		playlist_obj = FakePlaylist('benchmark-connection-reuse-{}'.format(length), videos)
+		default_pool = httppool.default_pool
+		for keep_alive in (False, True):
+			#a pool that keeps nothing idle opens a connection per request, like plain urllib
+			httppool.default_pool = httppool.ConnectionPool(max_idle_per_host=httppool.MAX_IDLE_PER_HOST if keep_alive else 0)
+			try:
+				params = {'videos':length, 'keep_alive':keep_alive, 'connections':backend.STREAM_CONNECTIONS}
+				self.measure('connection_reuse', params, item_size*length, self.download_case(videos[0], playlist_obj, '360p', backend.STREAM_CONNECTIONS, items))
+			finally:
+				httppool.default_pool.clear()
+				httppool.default_pool = default_pool
+
+	def run_content_store(self, length, item_size):
+		items = [synthetic_data(item_size, SEED+i) for i in range(length)]
+		videos = [self.add_video([(PROGRESSIVE_360P, data)]) for data in items]
+		playlist_obj = FakePlaylist('benchmark-content-store-{}'.format(length), videos)
+		content_store = contentstore.ContentStore(os.path.join(self.workspace, 'content-store'))
+		params = {'videos':length, 'workers':backend.PLAYLIST_WORKERS}
+		#the first run fills the store, every measured one is served from it
+		run, cleanup = self.download_case(videos[0], playlist_obj, '360p', backend.STREAM_CONNECTIONS, items, content_store=content_store)()
+		try:
+			run()()
+		finally:
+			cleanup()
+		self.measure('content_store_restore', params, item_size*length, self.download_case(videos[0], playlist_obj, '360p', backend.STREAM_CONNECTIONS, items, content_store=content_store))
+
+	def get_media_fixtures(self):
+		if not self.media_fixtures:
+			self.media_fixtures = create_media_fixtures(self.workspace)
+		return self.media_fixtures
+
+
+def compare_with_baseline(results, baseline_path):
+	with open(baseline_path) as fh:
+		baseline = json.load(fh)
+	medians = {(result['name'], json.dumps(result['params'], sort_keys=True)):result['median_seconds'] for result in baseline['results'] if 'median_seconds' in result}
+	for result in results:
+		median = medians.get((result['name'], json.dumps(result['params'], sort_keys=True)))
+		if median and result.get('median_seconds'):
+			result['baseline_median_seconds'] = median
+			result['speedup'] = median/result['median_seconds']
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog='benchmark', description='Measure MinYTD download throughput against a local fake CDN and write the results as JSON.')
+	parser.add_argument('-o', '--output', help='write results to this file instead of stdout')
+	parser.add_argument('-n', '--repeats', type=int, default=REPEATS, help='runs per case, the median is reported')
+	parser.add_argument('--latency', type=float, default=0, help='delay before every response in milliseconds')
+	parser.add_argument('--handshake-latency', type=float, default=0, help='delay before every new connection in milliseconds')
+	parser.add_argument('--bandwidth', type=float, default=0, help='per connection bandwidth cap in bytes per second (0 for none)')
+	parser.add_argument('--no-ranges', action='store_true', help='ignore Range headers like a server without range support')
+	parser.add_argument('--size', type=int, default=PROGRESSIVE_SIZE, help='progressive stream size in bytes')
+	parser.add_argument('--playlist-lengths', type=int, nargs='+', default=list(PLAYLIST_LENGTHS))
+	parser.add_argument('--playlist-item-size', type=int, default=PLAYLIST_ITEM_SIZE)
+	parser.add_argument('--connection-reuse-videos', type=int, default=CONNECTION_REUSE_VIDEOS, help='playlist length for comparing fresh and keep-alive connections')
+	parser.add_argument('--baseline', help='earlier results file to compute speedups against')
+	return parser.parse_args(argv)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	cdn = FakeCDN(args.latency/1000, args.bandwidth, not args.no_ranges, args.handshake_latency/1000)
+	cdn.start()
+	workspace = tempfile.mkdtemp(prefix='minytd-benchmark-')
+	try:
+		benchmark = Benchmark(cdn, workspace, args.repeats)
+		benchmark.run_progressive(args.size)
+		benchmark.run_adaptive()
+		benchmark.run_mux()
+		benchmark.run_progress_callbacks()
+		benchmark.run_startup()
+		benchmark.run_playlists(args.playlist_lengths, args.playlist_item_size)
+		benchmark.run_connection_reuse(args.connection_reuse_videos, args.playlist_item_size)
+		benchmark.run_content_store(max(args.playlist_lengths), args.playlist_item_size)
+	finally:
+		cdn.stop()
+		shutil.rmtree(workspace, ignore_errors=True)
+	if args.baseline:
+		compare_with_baseline(benchmark.results, args.baseline)
+	report = {
+		'environment':{
+			'python':platform.python_version(),
+			'platform':platform.platform(),
+			'cpu_count':os.cpu_count(),
+			'pytube':pytube.__version__,
+			'ffmpeg':benchmark.ffmpeg_exists,
+			'revision':git_revision(),
+			'timestamp':time.time(),
+		},
+		'config':{
+			'repeats':benchmark.repeats,
+			'latency_ms':args.latency,
+			'handshake_latency_ms':args.handshake_latency,
+			'bandwidth_bps':args.bandwidth,
+			'ranges':cdn.ranges,
+		},
+		'results':benchmark.results,
+	}
+	if args.output:
+		with open(args.output, 'w') as fh:
+			json.dump(report, fh, indent=1)
+	else:
+		json.dump(report, sys.stdout, indent=1)
+		sys.stdout.write('\n')
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
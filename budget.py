@@ -0,0 +1,65 @@
+import statistics
+import threading
+import json
+import time
+import os
+import metrics
+
+
+RECENT_DOWNLOADS = 20
+LOG_TAIL_BYTES = 262144
+DEFAULT_THROUGHPUT = 1048576
+THROUGHPUT_SMOOTHING = 0.3
+
+
+def read_recent_throughput(path=metrics.METRICS_LOG_FILE, count=RECENT_DOWNLOADS):
+	if not path:
+		return None
+	try:
+		with open(path, 'rb') as fh:
+			size = fh.seek(0, os.SEEK_END)
+			fh.seek(max(0, size-LOG_TAIL_BYTES))
+			lines = fh.read().splitlines()
+	except OSError:
+		return None
+	samples = []
+	for line in reversed(lines):
+		try:
+			entry = json.loads(line)
+		except ValueError:
+			continue
+		if entry.get('event') == 'video' and entry.get('status') == metrics.STATUS_COMPLETE and entry.get('throughput_bps'):
+			samples.append(entry['throughput_bps'])
+			if len(samples) >= count:
+				break
+	return statistics.median(samples) if samples else None
+
+
+class DownloadBudget:
+	def __init__(self, size=None, seconds=None, throughput=None, parallelism=1):
+		self.size = size
+		self.seconds = seconds
+		self.throughput = throughput or DEFAULT_THROUGHPUT
+		self.parallelism = max(1, parallelism)
+		self.spent = 0
+		self.started = time.monotonic()
+		self.lock = threading.Lock()
+
+	def get_allowance(self, items_left):
+		#bytes the next item may take so the items after it still fit, the tighter of the two limits wins
+		items_left = max(1, items_left)
+		allowances = []
+		with self.lock:
+			if self.size:
+				allowances.append((self.size-self.spent)/items_left)
+			if self.seconds:
+				seconds_left = self.seconds - (time.monotonic()-self.started)
+				allowances.append(self.throughput*self.parallelism*seconds_left/items_left)
+		return max(0, min(allowances)) if allowances else float('inf')
+
+	def record(self, size, seconds=None):
+		with self.lock:
+			self.spent += size
+			if size and seconds:
+				#follow the bandwidth this job actually gets rather than what earlier ones got
+				self.throughput += THROUGHPUT_SMOOTHING*(size/seconds-self.throughput)
@@ -0,0 +1,201 @@
+import pytube
+import collections
+import contextlib
+import threading
+import urllib.parse
+import sqlite3
+import json
+import time
+import os
+
+
+METADATA_CACHE_SIZE = 64
+METADATA_CACHE_TTL = 1800
+
+
+class MetadataCache:
+	def __init__(self, maxsize=METADATA_CACHE_SIZE, ttl=METADATA_CACHE_TTL):
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self.entries = collections.OrderedDict()
+		self.loading = {}
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			return self._get(key)
+
+	def _get(self, key):
+		entry = self.entries.get(key)
+		if entry is None:
+			return None
+		expires_at, value = entry
+		if expires_at < time.monotonic():
+			del self.entries[key]
+			return None
+		self.entries.move_to_end(key)
+		return value
+
+	def put(self, key, value):
+		with self.lock:
+			self._put(key, value)
+
+	def _put(self, key, value):
+		self.entries[key] = (time.monotonic()+self.ttl, value)
+		self.entries.move_to_end(key)
+		while len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+	def invalidate(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def get_or_load(self, key, loader):
+		#concurrent lookups of the same key share one load instead of racing
+		while True:
+			with self.lock:
+				value = self._get(key)
+				if value is not None:
+					return value
+				event = self.loading.get(key)
+				if event is None:
+					event = self.loading[key] = threading.Event()
+					break
+			event.wait()
+		try:
+			value = loader()
+			self.put(key, value)
+			return value
+		finally:
+			with self.lock:
+				del self.loading[key]
+			event.set()
+
+
+MANIFEST_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest-cache.sqlite3')
+MANIFEST_CACHE_TTL = 18000
+PLAYLIST_CACHE_TTL = 3600
+STREAM_URL_EXPIRY_MARGIN = 600
+SQLITE_TIMEOUT = 30
+
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS playlists (
+	playlist_id TEXT PRIMARY KEY,
+	video_ids TEXT NOT NULL,
+	expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS videos (
+	video_id TEXT PRIMARY KEY,
+	title TEXT NOT NULL,
+	length INTEGER,
+	expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS streams (
+	video_id TEXT NOT NULL,
+	itag INTEGER NOT NULL,
+	type TEXT NOT NULL,
+	subtype TEXT NOT NULL,
+	progressive INTEGER NOT NULL,
+	resolution TEXT,
+	abr TEXT,
+	filesize INTEGER,
+	raw TEXT NOT NULL,
+	PRIMARY KEY (video_id, itag)
+);
+'''
+
+
+def url_expiry(url):
+	try:
+		return float(urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)['expire'][0])
+	except (KeyError, IndexError, ValueError):
+		return None
+
+
+def raw_stream(st):
+	return {
+		'url':st.url,
+		'itag':st.itag,
+		'type':'{}; codecs="{}"'.format(st.mime_type, ', '.join(st.codecs)),
+		'is_otf':st.is_otf,
+		'bitrate':st.bitrate,
+		'fps':st.fps,
+	}
+
+
+def get_content_lengths(yt):
+	#pytube never reads contentLength, but the raw formats of a fresh resolve carry it
+	streaming_data = yt.player_response.get('streamingData', {}) if isinstance(yt.player_response, dict) else {}
+	lengths = {}
+	for fmt in streaming_data.get('formats', []) + streaming_data.get('adaptiveFormats', []):
+		if str(fmt.get('contentLength', '')).isdigit():
+			lengths[fmt['itag']] = int(fmt['contentLength'])
+	return lengths
+
+
+def hydrate_video(video_id, title, length, streams):
+	yt = pytube.YouTube('https://youtube.com/watch?v='+video_id, defer_prefetch_init=True)
+	yt.player_response = {'videoDetails':{'title':title, 'lengthSeconds':length}}
+	yt.stream_monostate.title = title
+	yt.stream_monostate.duration = length
+	for raw, filesize in streams:
+		st = pytube.Stream(stream=raw, player_config_args=yt.player_config_args, monostate=yt.stream_monostate)
+		st._filesize = filesize
+		yt.fmt_streams.append(st)
+	return yt
+
+
+class ManifestCache:
+	def __init__(self, path=MANIFEST_CACHE_FILE, ttl=MANIFEST_CACHE_TTL, playlist_ttl=PLAYLIST_CACHE_TTL):
+		self.path = path
+		self.ttl = ttl
+		self.playlist_ttl = playlist_ttl
+		self.schema_ready = False
+
+	def connect(self):
+		connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT)
+		if not self.schema_ready:
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.executescript(MANIFEST_SCHEMA)
+			self.schema_ready = True
+		return contextlib.closing(connection)
+
+	def get_playlist(self, playlist_id):
+		with self.connect() as connection:
+			row = connection.execute('SELECT video_ids FROM playlists WHERE playlist_id=? AND expires_at>?', (playlist_id, time.time())).fetchone()
+		return json.loads(row[0]) if row else None
+
+	def put_playlist(self, playlist_id, video_ids):
+		with self.connect() as connection, connection:
+			connection.execute('INSERT OR REPLACE INTO playlists VALUES (?, ?, ?)', (playlist_id, json.dumps(video_ids), time.time()+self.playlist_ttl))
+
+	def get_video(self, video_id):
+		with self.connect() as connection:
+			video_row = connection.execute('SELECT title, length FROM videos WHERE video_id=? AND expires_at>?', (video_id, time.time())).fetchone()
+			if not video_row:
+				return None
+			stream_rows = connection.execute('SELECT raw, filesize FROM streams WHERE video_id=?', (video_id,)).fetchall()
+		title, length = video_row
+		return hydrate_video(video_id, title, length, [(json.loads(raw), filesize) for raw, filesize in stream_rows])
+
+	def put_video(self, yt):
+		expires_at = time.time() + self.ttl
+		for st in yt.fmt_streams:
+			expiry = url_expiry(st.url)
+			if expiry:
+				expires_at = min(expires_at, expiry-STREAM_URL_EXPIRY_MARGIN)
+		content_lengths = get_content_lengths(yt)
+		for st in yt.fmt_streams:
+			#sized here, the streams of this resolve skip their HEAD request as well as the ones hydrated from the cache later
+			if st._filesize is None:
+				st._filesize = content_lengths.get(st.itag)
+		rows = [(yt.video_id, st.itag, st.type, st.subtype, int(st.is_progressive), st.resolution, st.abr, st._filesize, json.dumps(raw_stream(st))) for st in yt.fmt_streams]
+		with self.connect() as connection, connection:
+			connection.execute('DELETE FROM streams WHERE video_id=?', (yt.video_id,))
+			connection.executemany('INSERT INTO streams VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+			connection.execute('INSERT OR REPLACE INTO videos VALUES (?, ?, ?, ?)', (yt.video_id, yt.title, yt.length, expires_at))
+
+	def invalidate(self, video_id):
+		with self.connect() as connection, connection:
+			connection.execute('DELETE FROM streams WHERE video_id=?', (video_id,))
+			connection.execute('DELETE FROM videos WHERE video_id=?', (video_id,))
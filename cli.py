@@ -0,0 +1,122 @@
+import argparse
+import json
+import sys
+import time
+import backend
+
+
+PROGRESS_INTERVAL = 0.5
+
+
+def emit(event, **fields):
+	fields['event'] = event
+	sys.stdout.write(json.dumps(fields) + '\n')
+	sys.stdout.flush()
+
+
+def read_urls(args):
+	urls = list(args.urls)
+	for path in args.file:
+		with open(path) as fh:
+			urls += [line.strip() for line in fh if line.strip() and not line.strip().startswith('#')]
+	return urls
+
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(prog='minytd', description='Download YouTube videos and playlists without the GUI, reporting progress as JSON lines.')
+	parser.add_argument('urls', nargs='*', help='video or playlist URLs')
+	parser.add_argument('-f', '--file', action='append', default=[], help='file with one URL per line (repeatable)')
+	parser.add_argument('-r', '--resolution', default='Highest available', help="resolution such as 720p (default: 'Highest available')")
+	parser.add_argument('-a', '--audio-only', choices=sorted(set(backend.AUDIO_FORMATS.values())), help='download only the audio track as m4a or mp3 (mp3 needs ffmpeg)')
+	parser.add_argument('-d', '--destination', default='.', help='destination folder (default: current folder)')
+	parser.add_argument('-j', '--concurrency', type=int, help='number of downloads to run at once (default: {} for the process engine, {} for asyncio)'.format(backend.MAX_CONCURRENT_TASKS, backend.ASYNC_MAX_CONCURRENT_TASKS))
+	parser.add_argument('-p', '--playlist', action='store_true', help='download the entire playlist for playlist URLs')
+	parser.add_argument('--engine', choices=[backend.ENGINE_PROCESS, backend.ENGINE_ASYNCIO], default=backend.DOWNLOAD_ENGINE)
+	parser.add_argument('--connections', type=int, default=backend.STREAM_CONNECTIONS, help='connections per stream')
+	parser.add_argument('--metrics-port', type=int, help='serve aggregated download metrics for scraping on this local port (0 picks a free one)')
+	parser.add_argument('--size-budget', type=float, help='total bytes a task may download, lower qualities are picked per video to fit')
+	parser.add_argument('--time-budget', type=float, help='seconds a task should finish in, lower qualities are picked per video from measured throughput')
+	parser.add_argument('--rate-limit', type=float, default=backend.GLOBAL_RATE_LIMIT, help='global bandwidth cap in bytes per second (0 for none)')
+	return parser.parse_args(argv)
+
+
+def queue_tasks(backend_obj, urls, args):
+	tasks = []
+	#all urls are looked up at once, tasks are still queued in the order given
+	for summary in backend_obj.validate_urls(urls):
+		url = summary['url']
+		if not summary['valid']:
+			emit('error', url=url, reason='exception' if summary['exception'] else 'invalid url')
+			continue
+		resolution = backend_obj.choose_resolution(args.resolution, summary['resolutions'])
+		if args.audio_only:
+			resolution = backend.AUDIO_ONLY_M4A if args.audio_only == 'm4a' else backend.AUDIO_ONLY_MP3
+			if resolution not in summary['resolutions']:
+				emit('error', url=url, reason='no {} audio available'.format(args.audio_only))
+				continue
+		playlist_obj = summary['playlist_obj'] if args.playlist else None
+		task = backend_obj.create_task(summary['video_obj'], playlist_obj, resolution, args.destination)
+		task.start()
+		emit('queued', id=len(tasks), url=url, title=task.title, playlist=playlist_obj is not None, resolution=resolution, playlist_size=summary['playlist_size'])
+		tasks.append(task)
+	return tasks
+
+
+def wait_for_tasks(backend_obj, tasks):
+	reported = {}
+	pending = set(range(len(tasks)))
+	while pending:
+		active = sorted(pending)
+		for i, status in zip(active, backend_obj.get_task_statuses([tasks[i] for i in active])):
+			task = tasks[i]
+			if status['state'] == 'complete':
+				emit('complete', id=i, title=task.title)
+				task.release()
+				pending.discard(i)
+			elif status['state'] == 'failed':
+				emit('failed', id=i, title=task.title)
+				task.release()
+				pending.discard(i)
+			elif status['state'] != 'queued':
+				progress = round(status['progress'], 2)
+				if reported.get(i) != progress:
+					reported[i] = progress
+					emit('progress', id=i, title=task.title, progress=progress, rate=round(status['rate']))
+		if pending:
+			time.sleep(PROGRESS_INTERVAL)
+
+
+def main(argv=None):
+	args = parse_args(argv)
+	urls = read_urls(args)
+	if not urls:
+		emit('error', reason='no urls given')
+		return 2
+	backend_obj = backend.YTD()
+	backend_obj.engine = args.engine
+	backend_obj.stream_connections = args.connections
+	if args.concurrency is not None:
+		backend_obj.set_max_concurrency(args.concurrency)
+	backend_obj.set_rate_limit(args.rate_limit)
+	backend_obj.size_budget = args.size_budget
+	backend_obj.time_budget = args.time_budget
+	if args.metrics_port is not None:
+		emit('metrics', url=backend_obj.start_metrics_exporter(args.metrics_port))
+	tasks = []
+	try:
+		tasks = queue_tasks(backend_obj, urls, args)
+		wait_for_tasks(backend_obj, tasks)
+	except KeyboardInterrupt:
+		for task in tasks:
+			task.kill()
+		emit('cancelled')
+		return 130
+	finally:
+		backend_obj.shutdown()
+	failed = sum(1 for task in tasks if not task.is_complete())
+	emit('done', queued=len(tasks), completed=len(tasks)-failed, failed=failed, rejected=len(urls)-len(tasks))
+	return 0 if not failed and len(tasks) == len(urls) else 1
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,114 @@
+import contextlib
+import sqlite3
+import shutil
+import uuid
+import time
+import os
+
+
+CONTENT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'content-store')
+CONTENT_STORE_MAX_BYTES = 20*1024*1024*1024
+#a destination on another disk than the store would double the write of every download, those are only stored when asked for
+CONTENT_STORE_COPY = False
+INDEX_FILENAME = 'index.sqlite3'
+SQLITE_TIMEOUT = 30
+
+CONTENT_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+	key TEXT PRIMARY KEY,
+	size INTEGER NOT NULL,
+	last_used REAL NOT NULL
+);
+'''
+
+
+def link_or_copy(src, dst, copy=True):
+	#a hardlink costs nothing on the same filesystem, across filesystems only a copy will do
+	tmp = '{}.{}.tmp'.format(dst, uuid.uuid4().hex[:8])
+	try:
+		try:
+			os.link(src, tmp)
+		except OSError:
+			if not copy:
+				return False
+			shutil.copyfile(src, tmp)
+		os.replace(tmp, dst)
+		#renaming onto another link of the same file does nothing and leaves the temporary name behind
+		if os.path.lexists(tmp):
+			os.remove(tmp)
+	except:
+		with contextlib.suppress(OSError):
+			os.remove(tmp)
+		raise
+	return True
+
+
+class ContentStore:
+	def __init__(self, directory=CONTENT_STORE_DIR, max_bytes=CONTENT_STORE_MAX_BYTES, copy=CONTENT_STORE_COPY):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.copy = copy
+		self.schema_ready = False
+
+	def connect(self):
+		if not self.schema_ready:
+			os.makedirs(self.directory, exist_ok=True)
+		connection = sqlite3.connect(os.path.join(self.directory, INDEX_FILENAME), timeout=SQLITE_TIMEOUT)
+		if not self.schema_ready:
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.executescript(CONTENT_STORE_SCHEMA)
+			self.schema_ready = True
+		return contextlib.closing(connection)
+
+	def get_key(self, video_id, itags, extension):
+		#the same itags can end up as different files, like an m4a and an mp3 of one audio stream
+		return '{}-{}{}'.format(video_id, '+'.join(str(itag) for itag in itags), extension)
+
+	def get_path(self, key):
+		return os.path.join(self.directory, key)
+
+	def restore(self, key, output_path):
+		with self.connect() as connection, connection:
+			row = connection.execute('SELECT size FROM items WHERE key=?', (key,)).fetchone()
+			if not row:
+				return False
+			path = self.get_path(key)
+			if not os.path.isfile(path) or os.path.getsize(path) != row[0]:
+				connection.execute('DELETE FROM items WHERE key=?', (key,))
+				return False
+			connection.execute('UPDATE items SET last_used=? WHERE key=?', (time.time(), key))
+		try:
+			link_or_copy(path, output_path)
+		except FileNotFoundError:
+			#evicted by another task between the lookup and the link
+			return False
+		return True
+
+	def put(self, key, path):
+		size = os.path.getsize(path)
+		if size > self.max_bytes:
+			return
+		stored_path = self.get_path(key)
+		with self.connect() as connection, connection:
+			row = connection.execute('SELECT size FROM items WHERE key=?', (key,)).fetchone()
+		if not row or not os.path.isfile(stored_path) or os.path.getsize(stored_path) != row[0]:
+			if not link_or_copy(path, stored_path, self.copy):
+				return
+		with self.connect() as connection, connection:
+			connection.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?)', (key, size, time.time()))
+		self.evict()
+
+	def evict(self):
+		#least recently used first, files already linked into destinations keep their data
+		with self.connect() as connection, connection:
+			rows = connection.execute('SELECT key, size FROM items ORDER BY last_used DESC').fetchall()
+			total = 0
+			evicted = []
+			for key, size in rows:
+				total += size
+				if total > self.max_bytes:
+					evicted.append(key)
+			connection.executemany('DELETE FROM items WHERE key=?', [(key,) for key in evicted])
+		for key in evicted:
+			with contextlib.suppress(FileNotFoundError):
+				os.remove(self.get_path(key))
@@ -2,7 +2,9 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter import filedialog
 from tkinter import messagebox
+import concurrent.futures
 import threading
+import time
 
 
 APP_NAME = 'MinYTD'
@@ -14,71 +16,291 @@ def spinning_cursor():
 			yield c
 				
 
-class Task:
-	def __init__(self, backend_obj):
-		self.WINDOW_TITLE = APP_NAME
-		self.WINDOW_MINIMUM_HEIGHT = 0
-		self.WINDOW_MINIMUM_WIDTH = 250
+def format_rate(rate):
+	for unit in ('B/s', 'KB/s'):
+		if rate < 1024:
+			return '{:.0f} {}'.format(rate, unit)
+		rate /= 1024
+	return '{:.1f} MB/s'.format(rate)
+	
+	
+def format_eta(seconds):
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return '{}:{:02d}:{:02d}'.format(hours, minutes, seconds) if hours else '{}:{:02d}'.format(minutes, seconds)
+	
+
+class DownloadsPanel:
+	def __init__(self, root, backend_obj):
+		self.WINDOW_TITLE = APP_NAME + ' - Downloads'
+		self.WINDOW_MINIMUM_HEIGHT = 150
+		self.WINDOW_MINIMUM_WIDTH = 560
 		self.FRAME_INTERNAL_PADDING = {'x':2, 'y':2}
 		self.WIDGET_EXTERNAL_PADDING = {'x':2, 'y':1}
+		self.CANCEL_BTN_TXT = 'Cancel selected'
+		self.DISCARD_BTN_TXT = 'Discard selected'
+		self.REFRESH_INTERVAL_MS = 250
+		self.COLUMNS = {'title':('Title', 220), 'status':('Status', 110), 'progress':('Progress', 70), 'speed':('Speed', 80), 'eta':('ETA', 60)}
 		
 		self.backend_obj = backend_obj
-		self.title = backend_obj.title
-		self._is_killed = False
-
-		self.window = tk.Toplevel()
+		self.tasks = {}
+		self.rows = {}
+		self.active = []
+		self.refresh_after_id = None
+		
+		self.window = tk.Toplevel(root)
 		self.window.title(self.WINDOW_TITLE)
 		self.window.minsize(self.WINDOW_MINIMUM_WIDTH, self.WINDOW_MINIMUM_HEIGHT)
-		self.window.protocol('WM_DELETE_WINDOW', self.on_close)
-		self.window.resizable(0,0)
+		#closing only hides the panel, downloads keep running until cancelled
+		self.window.protocol('WM_DELETE_WINDOW', self.window.withdraw)
+		self.window.rowconfigure(0, weight=1)
+		self.window.columnconfigure(0, weight=1)
 		
 		self.frame = tk.Frame(self.window)
 		self.frame.config(padx=self.FRAME_INTERNAL_PADDING['x'], pady=self.FRAME_INTERNAL_PADDING['y'])
+		self.frame.rowconfigure(0, weight=1)
+		self.frame.columnconfigure(0, weight=1)
 		
-		self.title_lbl = tk.Label(self.frame, text=self.title)
-		self.progressbar = ttk.Progressbar(self.frame, orient=tk.HORIZONTAL)
+		self.tree = ttk.Treeview(self.frame, columns=list(self.COLUMNS), show='headings')
+		for column, (heading, width) in self.COLUMNS.items():
+			self.tree.heading(column, text=heading)
+			self.tree.column(column, width=width, stretch=column=='title')
+		self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+		self.tree.config(yscrollcommand=self.scrollbar.set)
+		self.btn_frame = tk.Frame(self.frame)
+		self.discard_btn = tk.Button(self.btn_frame, text=self.DISCARD_BTN_TXT, command=self.command_discard_btn)
+		self.cancel_btn = tk.Button(self.btn_frame, text=self.CANCEL_BTN_TXT, command=self.command_cancel_btn)
 		
-		self.download_status_lbl = tk.Label(self.frame)
-
 		self.packer()
 		
 	def packer(self):
-		self.frame.pack(expand=True, fill=tk.BOTH)		
-		self.title_lbl.pack(padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
-		self.progressbar.pack(expand=True, fill=tk.X, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
-		self.download_status_lbl.pack(side=tk.LEFT)
-		
-	def start(self):
-		self.backend_obj.start()
-		self.update_progressbar()
-		
-	def kill(self):
-		if not self.is_complete():
-			self.backend_obj.kill()
-		self._is_killed = True
-		self.window.destroy()
-
-	def is_killed(self):
-		return self._is_killed
+		self.frame.grid(row=0, column=0, sticky='nsew')
+		self.tree.grid(row=0, column=0, sticky='nsew', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.scrollbar.grid(row=0, column=1, sticky='ns')
+		self.btn_frame.grid(row=1, column=0, sticky='e')
+		self.discard_btn.pack(side=tk.RIGHT, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.cancel_btn.pack(side=tk.RIGHT, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
 		
-	def is_complete(self):
-		return self.backend_obj.is_complete()
+	def add(self, task):
+		row = self.tree.insert('', tk.END, values=(task.title, 'Queued..', '', '', ''))
+		self.tasks[row] = task
+		self.active.append(row)
+		self.window.deiconify()
+		if not self.refresh_after_id:
+			self.refresh()
+			
+	def kill(self, row):
+		if row in self.active:
+			self.tasks[row].kill()
+			self.active.remove(row)
+			self.set_row(row, ('Cancelled.', '', '', ''))
+			
+	def discard(self, row):
+		#cancelled and failed downloads resume when queued again, discarding also deletes what they fetched so far
+		if not self.tasks[row].is_complete():
+			self.tasks[row].discard()
+			if row in self.active:
+				self.active.remove(row)
+			self.set_row(row, ('Discarded.', '', '', ''))
+			
+	def kill_all(self):
+		for row in list(self.active):
+			self.kill(row)
+			
+	def command_cancel_btn(self):
+		for row in self.tree.selection():
+			self.kill(row)
+			
+	def command_discard_btn(self):
+		for row in self.tree.selection():
+			self.discard(row)
 		
-	def on_close(self):
-		self.kill()
-	
-	def update_progressbar(self):
-		if not self.is_complete():
-			self.progressbar['value'] = self.backend_obj.get_progress()
-			self.download_status_lbl['text'] = 'Downloading.. ' + '{:.2f}'.format(self.backend_obj.get_progress()).rstrip('0').rstrip('.') + '%'
-			self.window.after(100, self.update_progressbar)
+	def refresh(self):
+		#every active task is read in one batched call and only rows whose text changed are redrawn
+		statuses = self.backend_obj.get_task_statuses([self.tasks[row] for row in self.active])
+		for row, status in zip(list(self.active), statuses):
+			if status['state'] in ('complete', 'failed'):
+				self.tasks[row].release()
+				self.active.remove(row)
+			self.set_row(row, self.format_status(status))
+		self.refresh_after_id = self.window.after(self.REFRESH_INTERVAL_MS, self.refresh) if self.active else None
+			
+	def set_row(self, row, values):
+		values = (self.tasks[row].title,) + values
+		if self.rows.get(row) != values:
+			self.rows[row] = values
+			self.tree.item(row, values=values)
+			
+	def format_status(self, status):
+		if status['state'] == 'queued':
+			return ('Queued..', '', '', '')
+		if status['state'] == 'failed':
+			return ('Download Failed.', '', '', '')
+		if status['state'] == 'complete':
+			return ('Download Complete.', '100%', '', '')
+		progress = '{:.1f}'.format(status['progress']).rstrip('0').rstrip('.') + '%'
+		if status['playlist']:
+			speed = '{:.0f}/{:.0f} videos'.format(status['done'], status['total']) if status['total'] else ''
 		else:
-			self.progressbar['value'] = 100
-			self.download_status_lbl['text'] = 'Download Complete.'
+			speed = format_rate(status['rate']) if status['rate'] else ''
+		eta = format_eta(status['eta']) if status['eta'] is not None else ''
+		return ('Downloading..', progress, speed, eta)
+				
+
+class BulkIntakeDialog:
+	def __init__(self, root, backend_obj, downloads_panel_getter, resolutions, destination=''):
+		self.WINDOW_TITLE = APP_NAME + ' - Add many'
+		self.WINDOW_MINIMUM_HEIGHT = 360
+		self.WINDOW_MINIMUM_WIDTH = 560
+		self.FRAME_INTERNAL_PADDING = {'x':2, 'y':2}
+		self.WIDGET_EXTERNAL_PADDING = {'x':2, 'y':1}
+		self.URLS_LBL_TXT = 'One URL per line'
+		self.LOAD_BTN_TXT = 'Load file'
+		self.VALIDATE_BTN_TXT = 'Check URLs'
+		self.PLAYLIST_CHECKBTN_TXT = 'download entire playlists'
+		self.RESOLUTION_LBL_TXT = 'Resolution'
+		self.DESTINATION_LBL_TXT = 'Destination'
+		self.BROWSE_BTN_TXT = 'Browse'
+		self.QUEUE_BTN_TXT = 'Queue valid'
+		self.POLL_INTERVAL_MS = 50
+		self.COLUMNS = {'url':('URL', 260), 'status':('Status', 80), 'playlist':('Playlist', 70), 'resolutions':('Resolutions', 150)}
+		
+		self.backend_obj = backend_obj
+		self.downloads_panel_getter = downloads_panel_getter
+		self.summaries = []
+		self.validation = None
+		self.resolution_option_value = tk.StringVar(value=resolutions[0])
+		self.playlist_checkbtn_value = tk.IntVar(value=0)
+		self.destination_entry_value = tk.StringVar(value=destination)
+		
+		self.window = tk.Toplevel(root)
+		self.window.title(self.WINDOW_TITLE)
+		self.window.minsize(self.WINDOW_MINIMUM_WIDTH, self.WINDOW_MINIMUM_HEIGHT)
+		self.window.rowconfigure(0, weight=1)
+		self.window.columnconfigure(0, weight=1)
+		
+		self.frame = tk.Frame(self.window)
+		self.frame.config(padx=self.FRAME_INTERNAL_PADDING['x'], pady=self.FRAME_INTERNAL_PADDING['y'])
+		self.frame.rowconfigure([1,3], weight=1)
+		self.frame.columnconfigure(0, weight=1)
+		#url list
+		self.urls_lbl = tk.Label(self.frame, text=self.URLS_LBL_TXT)
+		self.urls_text = tk.Text(self.frame, height=8, wrap=tk.NONE)
+		self.urls_btn_frame = tk.Frame(self.frame)
+		self.load_btn = tk.Button(self.urls_btn_frame, text=self.LOAD_BTN_TXT, command=self.command_load_btn)
+		self.validate_btn = tk.Button(self.urls_btn_frame, text=self.VALIDATE_BTN_TXT, command=self.command_validate_btn)
+		self.validating_lbl = tk.Label(self.urls_btn_frame, text='')
+		#summary table
+		self.tree = ttk.Treeview(self.frame, columns=list(self.COLUMNS), show='headings', height=8)
+		for column, (heading, width) in self.COLUMNS.items():
+			self.tree.heading(column, text=heading)
+			self.tree.column(column, width=width, stretch=column=='url')
+		self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.tree.yview)
+		self.tree.config(yscrollcommand=self.scrollbar.set)
+		#download options
+		self.options_frame = tk.Frame(self.frame)
+		self.options_frame.columnconfigure(3, weight=1)
+		self.playlist_checkbtn = tk.Checkbutton(self.options_frame, text=self.PLAYLIST_CHECKBTN_TXT, variable=self.playlist_checkbtn_value, onvalue=1, offvalue=0)
+		self.resolution_lbl = tk.Label(self.options_frame, text=self.RESOLUTION_LBL_TXT)
+		self.resolution_dropdwn = tk.OptionMenu(self.options_frame, self.resolution_option_value, *resolutions)
+		self.destination_lbl = tk.Label(self.options_frame, text=self.DESTINATION_LBL_TXT)
+		self.destination_entry = tk.Entry(self.options_frame, textvariable=self.destination_entry_value)
+		self.browse_btn = tk.Button(self.options_frame, text=self.BROWSE_BTN_TXT, command=self.command_browse_btn)
+		self.queue_btn = tk.Button(self.options_frame, text=self.QUEUE_BTN_TXT, command=self.command_queue_btn, state=tk.DISABLED)
+		
+		self.packer()
+		
+	def packer(self):
+		self.frame.grid(row=0, column=0, sticky='nsew')
+		self.urls_lbl.grid(row=0, column=0, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.urls_text.grid(row=1, column=0, columnspan=2, sticky='nsew', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.urls_btn_frame.grid(row=2, column=0, columnspan=2, sticky='ew')
+		self.load_btn.pack(side=tk.LEFT, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.validate_btn.pack(side=tk.LEFT, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.validating_lbl.pack(side=tk.LEFT)
+		self.tree.grid(row=3, column=0, sticky='nsew', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.scrollbar.grid(row=3, column=1, sticky='ns')
+		self.options_frame.grid(row=4, column=0, columnspan=2, sticky='ew')
+		self.playlist_checkbtn.grid(row=0, column=0, columnspan=2, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.resolution_lbl.grid(row=1, column=0, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.resolution_dropdwn.grid(row=1, column=1, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.destination_lbl.grid(row=2, column=0, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.destination_entry.grid(row=2, column=1, columnspan=3, sticky='ew', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.browse_btn.grid(row=2, column=4, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.queue_btn.grid(row=3, column=4, sticky='e', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		
+	def get_urls(self):
+		lines = (line.strip() for line in self.urls_text.get('1.0', tk.END).splitlines())
+		#duplicates are checked once, the first occurrence keeps its place
+		return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+		
+	def command_load_btn(self):
+		path = filedialog.askopenfilename(parent=self.window, filetypes=[('Text files', '*.txt'), ('All files', '*')])
+		if path:
+			with open(path, encoding='utf-8', errors='replace') as fh:
+				self.urls_text.insert(tk.END, fh.read().strip() + '\n')
+				
+	def command_browse_btn(self):
+		self.destination_entry_value.set(filedialog.askdirectory(parent=self.window))
+		
+	def command_validate_btn(self):
+		urls = self.get_urls()
+		if not urls or self.validation:
+			return
+		self.summaries = []
+		self.tree.delete(*self.tree.get_children())
+		self.validate_btn.config(state=tk.DISABLED)
+		self.queue_btn.config(state=tk.DISABLED)
+		self.validation = concurrent.futures.Future()
+		threading.Thread(target=self.validate, args=(urls, self.validation), daemon=True).start()
+		self.on_validating(spinning_cursor())
+		
+	def validate(self, urls, future):
+		try:
+			future.set_result(self.backend_obj.validate_urls(urls))
+		except Exception as e:
+			future.set_exception(e)
+			
+	def on_validating(self, cursor):
+		if not self.validation.done():
+			self.validating_lbl['text'] = next(cursor)
+			self.window.after(self.POLL_INTERVAL_MS, self.on_validating, cursor)
+			return
+		validation, self.validation = self.validation, None
+		self.validating_lbl['text'] = ''
+		self.validate_btn.config(state=tk.NORMAL)
+		try:
+			self.summaries = validation.result()
+		except Exception:
+			messagebox.showerror("Error", "These URLs cannot be checked now.\nPlease try again later.", parent=self.window)
+			return
+		for summary in self.summaries:
+			self.tree.insert('', tk.END, values=self.format_summary(summary))
+		valid = sum(1 for summary in self.summaries if summary['valid'])
+		self.validating_lbl['text'] = '{} of {} valid'.format(valid, len(self.summaries))
+		if valid:
+			self.queue_btn.config(state=tk.NORMAL)
 			
+	def format_summary(self, summary):
+		if not summary['valid']:
+			return (summary['url'], 'Error' if summary['exception'] else 'Invalid', '', '')
+		playlist = '{} videos'.format(summary['playlist_size']) if summary['playlist_size'] is not None else ('Yes' if summary['playlist'] else '')
+		return (summary['url'], 'Valid', playlist, ', '.join(summary['resolutions']))
+		
+	def command_queue_btn(self):
+		if not self.destination_entry_value.get():
+			messagebox.showerror("Error", "Please select a destination folder", parent=self.window)
+			return
+		tasks = self.backend_obj.add_tasks(self.summaries, self.resolution_option_value.get(), self.destination_entry_value.get(), self.playlist_checkbtn_value.get())
+		downloads_panel = self.downloads_panel_getter()
+		for task in tasks:
+			downloads_panel.add(task)
+			task.start()
+		self.window.destroy()
+		
 
 class YTD:
-	def __init__(self, backend_obj):
+	def __init__(self, backend_future, started=None):
 		self.ROOT_WINDOW_ICON_FILE = 'icon.png'
 		self.ROOT_WINDOW_MINIMUM_WIDTH = 400
 		self.ROOT_WINDOW_MINIMUM_HEIGHT = 170
@@ -88,16 +310,17 @@ class YTD:
 		self.DESTINATION_LBL_TXT = 'Destination'
 		self.BROWSE_BTN_TXT = 'Browse'
 		self.DOWNLOAD_BTN_TXT = 'DOWNLOAD'
+		self.BULK_BTN_TXT = 'Add many..'
 		self.APP_FRAME_INTERNAL_PADDING = {'x':5, 'y':5}
 		self.FRAME_INTERNAL_PADDING = {'x':2, 'y':2}
 		self.WIDGET_EXTERNAL_PADDING = {'x':1, 'y':1}
+		self.URL_VALIDATION_DEBOUNCE_MS = 400
+		self.BACKEND_POLL_INTERVAL_MS = 50
 		
-		self.backend_obj = backend_obj
-		if self.backend_obj.ffmpeg_exists:
-			self.resolution_list_default = ['Highest available', '2160p', '1440p', '1080p', '720p', '480p', '360p', '144p']
-		else:
-			self.resolution_list_default = ['720p', '480p', '360p', '144p']
-		self.tasks = []
+		self.backend_future = backend_future
+		self.started = time.perf_counter() if started is None else started
+		self.downloads_panel = None
+		self.url_validation_after_id = None
 		
 			#create and configure root window
 		self.root = tk.Tk()
@@ -152,6 +375,8 @@ class YTD:
 		self.url_entry_right_clk_menu.add_command(label='Paste', command=lambda: self.url_entry.event_generate('<<Paste>>'))
 		#playlist checkbutton
 		self.playlist_checkbtn = tk.Checkbutton(self.url_frame, text=self.PLAYLIST_CHECKBTN_TXT, variable=self.playlist_checkbtn_value, onvalue=1, offvalue=0)
+		#bulk intake button
+		self.bulk_btn = tk.Button(self.url_frame, text=self.BULK_BTN_TXT)
 		
 			#create and configure resolution frame widgets
 		#resolution label
@@ -187,6 +412,7 @@ class YTD:
 		#packing into url frame
 		self.url_entry.grid(row=0, column=0, sticky='ew', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
 		self.playlist_checkbtn.grid(row=1, column=0, sticky='w', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
+		self.bulk_btn.grid(row=1, column=0, sticky='e', padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
 		#packing into resolution frame
 		self.resolution_lbl.pack(side=tk.LEFT, padx=self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
 		self.resolution_dropdwn.pack(side=tk.LEFT, padx=5+self.WIDGET_EXTERNAL_PADDING['x'], pady=self.WIDGET_EXTERNAL_PADDING['y'])
@@ -224,6 +450,7 @@ class YTD:
 		self.playlist_checkbtn.config(command=self.command_playlist_checkbtn)
 		self.browse_btn.config(command=self.command_browse_btn)
 		self.download_btn.config(command=self.command_download_btn)
+		self.bulk_btn.config(command=self.command_bulk_btn)
 		#protocols
 		self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 		#tracers
@@ -234,9 +461,30 @@ class YTD:
 	def run(self):
 		self.initialise()
 		self.bind_event_handlers()
-		if not self.backend_obj.ffmpeg_exists:
-				self.root.after(500, self.display_ffmpeg_not_exist_msgbox)
+		self.root.after_idle(self.on_window_shown)
 		self.root.mainloop()
+		
+	def get_backend_obj(self):
+		#the backend loads in the background, only user actions that need it wait for it
+		return self.backend_future.result()
+		
+	def get_resolution_list_default(self):
+		backend_obj = self.get_backend_obj()
+		if backend_obj.get_ffmpeg_exists():
+			return ['Highest available', '2160p', '1440p', '1080p', '720p', '480p', '360p', '144p'] + backend_obj.get_audio_resolutions()
+		return ['720p', '480p', '360p', '144p'] + backend_obj.get_audio_resolutions()
+		
+	def on_window_shown(self):
+		self.window_seconds = time.perf_counter() - self.started
+		self.on_backend_loading()
+		
+	def on_backend_loading(self):
+		if not self.backend_future.done() or not self.get_backend_obj().is_ffmpeg_probed():
+			self.root.after(self.BACKEND_POLL_INTERVAL_MS, self.on_backend_loading)
+			return
+		self.get_backend_obj().record_startup_timing('window_seconds', self.window_seconds)
+		if not self.get_backend_obj().get_ffmpeg_exists():
+			self.display_ffmpeg_not_exist_msgbox()
 	
 	#------------------event handlers-----------------------------------------#
 	
@@ -272,10 +520,10 @@ class YTD:
 	#commands		
 	def command_playlist_checkbtn(self):
 		if self.playlist_checkbtn_value.get():
-			self.enable_and_populate_resolution_dropdwn(self.resolution_list_default)
+			self.enable_and_populate_resolution_dropdwn(self.get_resolution_list_default())
 		else:
 			self.enable_and_populate_resolution_dropdwn(self.url_status['resolutions'])
-		self.backend_obj.download_entire_playlist = self.playlist_checkbtn_value.get()
+		self.get_backend_obj().download_entire_playlist = self.playlist_checkbtn_value.get()
 			
 	def command_browse_btn(self):
 		self.destination_entry_value.set(filedialog.askdirectory())
@@ -283,44 +531,55 @@ class YTD:
 	def command_download_btn(self):
 		if self.url_status['is_valid']:
 			if self.destination_entry_value.get():
-				task = Task(self.backend_obj.add_task())
-				self.tasks.append(task)
+				task = self.get_backend_obj().add_task()
+				self.get_downloads_panel().add(task)
 				task.start()
 			else:
 				messagebox.showerror("Error", "Please select a destination folder")
 		else:
 			messagebox.showerror("Error", "Please enter a valid URL")
 			
+	def command_bulk_btn(self):
+		BulkIntakeDialog(self.root, self.get_backend_obj(), self.get_downloads_panel, self.get_resolution_list_default(), self.destination_entry_value.get())
+			
 	#protocols
 	def on_close(self):
 		if messagebox.askokcancel("Quit", "Do you want to quit?\n(This will cancel all ongoing downloads, if any)"):
-			for task in self.tasks:
-				task.kill()
+			if self.downloads_panel:
+				self.downloads_panel.kill_all()
+			self.get_backend_obj().shutdown()
 			self.root.destroy()	
 		
 	#tracers		
 	def tracer_url_entry_value(self, *_):
-		t = threading.Thread(target=self.backend_obj.validate_url, args=(self.url_entry_value.get(),))
-		t.start()
-		self.on_url_validating(t)
-
+		self.url_status['is_valid'] = False
+		if self.url_validation_after_id:
+			self.root.after_cancel(self.url_validation_after_id)
+		self.url_validation_after_id = self.root.after(self.URL_VALIDATION_DEBOUNCE_MS, self.validate_url_entry_value)
 		
 	def tracer_resolution_option_value(self, *_):
-		self.backend_obj.resolution_chosen =  self.resolution_option_value.get()
+		self.get_backend_obj().resolution_chosen =  self.resolution_option_value.get()
 		
 	def tracer_destination_entry_value(self, *_):
-		self.backend_obj.destination = self.destination_entry_value.get()
+		self.get_backend_obj().destination = self.destination_entry_value.get()
 	
 	#helpers		
+	def validate_url_entry_value(self):
+		self.url_validation_after_id = None
+		generation = self.get_backend_obj().begin_validation()
+		t = threading.Thread(target=self.get_backend_obj().validate_url, args=(self.url_entry_value.get(), generation), daemon=True)
+		t.start()
+		self.on_url_validating(t, generation)
+		
 	def enable_playlist_checkbtn(self):		
 		self.playlist_checkbtn.config(state=tk.NORMAL)
 		self.playlist_checkbtn_enabled = True
-		self.backend_obj.download_entire_playlist = self.playlist_checkbtn_value.get()
+		self.get_backend_obj().download_entire_playlist = self.playlist_checkbtn_value.get()
 		
 	def disable_playlist_checkbtn(self):
 		self.playlist_checkbtn.config(state=tk.DISABLED)
 		self.playlist_checkbtn_enabled =False
-		self.backend_obj.download_entire_playlist = False
+		self.get_backend_obj().download_entire_playlist = False
 		
 	def enable_resolution_dropdwn(self):
 		self.resolution_dropdwn.config(state=tk.NORMAL)
@@ -336,33 +595,40 @@ class YTD:
 		for x in lst:
 			self.resolution_dropdwn['menu'].add_command(label=x, command=tk._setit(self.resolution_option_value, x))
 
+	def get_downloads_panel(self):
+		if not self.downloads_panel:
+			self.downloads_panel = DownloadsPanel(self.root, self.get_backend_obj())
+		return self.downloads_panel
+		
 	def display_ffmpeg_not_exist_msgbox(self):
 		messagebox.showinfo(APP_NAME, 'Your system does not contain FFmpeg.\nInstall FFmpeg to download high quality videos(1080p and above)')
 	
-	def on_url_validating(self, thread, cursor=None):
+	def on_url_validating(self, thread, generation, cursor=None):
+		if not self.get_backend_obj().is_current_validation(generation):
+			return
 		if not cursor:
 			cursor = spinning_cursor()
 		if thread.is_alive():
 			self.resolution_loading_lbl['text'] = next(cursor)
-			self.root.after(50, self.on_url_validating, thread, cursor)
+			self.root.after(50, self.on_url_validating, thread, generation, cursor)
 		else:
 			self.resolution_loading_lbl['text'] = ''
 			self.on_url_validating_finish()
 
 	def on_url_validating_finish(self):
-		self.url_status['is_valid'] = self.backend_obj.is_valid_url
-		self.url_status['is_playlist'] = self.backend_obj.is_playlist_url
-		self.url_status['resolutions'] = self.backend_obj.resolutions_available
+		self.url_status['is_valid'] = self.get_backend_obj().is_valid_url
+		self.url_status['is_playlist'] = self.get_backend_obj().is_playlist_url
+		self.url_status['resolutions'] = self.get_backend_obj().resolutions_available
 		if self.url_status['is_valid']:
 			if self.url_status['is_playlist']:
 				self.enable_playlist_checkbtn()
 			else:
 				self.disable_playlist_checkbtn()
 			if self.playlist_checkbtn_value.get() and self.playlist_checkbtn_enabled:
-				self.enable_and_populate_resolution_dropdwn(self.resolution_list_default)
+				self.enable_and_populate_resolution_dropdwn(self.get_resolution_list_default())
 			else:
 				self.enable_and_populate_resolution_dropdwn(self.url_status['resolutions'])
-		elif self.backend_obj.url_exception:
+		elif self.get_backend_obj().url_exception:
 			self.disable_playlist_checkbtn()
 			self.disable_resolution_dropdwn()
 			messagebox.showerror("Error", "This URL cannot be downloaded now.\nPlease try again later.")
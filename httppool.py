@@ -0,0 +1,199 @@
+import http.client
+import urllib.request
+import urllib.parse
+import urllib.error
+import collections
+import threading
+import json
+import os
+import time
+import io
+
+
+MAX_CONNECTIONS_PER_HOST = 16
+MAX_IDLE_PER_HOST = 16
+IDLE_TIMEOUT = 30
+DRAIN_LIMIT = 65536
+MAX_REDIRECTS = 5
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+#how a keep-alive connection fails when the server dropped it while it sat idle
+RETRY_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+PYTUBE_HEADERS = {'User-Agent': 'Mozilla/5.0', 'accept-language': 'en-US,en'}
+
+
+class PooledResponse:
+	def __init__(self, pool, key, connection, response, url):
+		self.pool = pool
+		self.key = key
+		self.connection = connection
+		self.response = response
+		self.url = url
+		self.status = response.status
+		self.reason = response.reason
+		self.headers = response.msg
+
+	def read(self, amt=None):
+		try:
+			data = self.response.read(amt)
+		except:
+			self.close()
+			raise
+		if self.response.isclosed():
+			self.release()
+		return data
+
+	def info(self):
+		return self.headers
+
+	def getcode(self):
+		return self.status
+
+	def geturl(self):
+		return self.url
+
+	def release(self):
+		if self.connection:
+			connection, self.connection = self.connection, None
+			self.pool.put(self.key, connection, reusable=self.response.isclosed() and not self.response.will_close)
+
+	def close(self):
+		#a short unread tail, like the byte of a range probe, is cheaper to drain than a new handshake
+		if self.connection and not self.response.isclosed() and self.response.length is not None and self.response.length <= DRAIN_LIMIT:
+			try:
+				self.response.read()
+			except (OSError, http.client.HTTPException):
+				pass
+		self.release()
+		self.response.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def __del__(self):
+		#pytube leaves some responses unclosed, the slot has to come back anyway
+		self.release()
+
+
+class ConnectionPool:
+	def __init__(self, max_connections_per_host=MAX_CONNECTIONS_PER_HOST, max_idle_per_host=MAX_IDLE_PER_HOST, idle_timeout=IDLE_TIMEOUT):
+		self.max_connections_per_host = max(1, max_connections_per_host)
+		self.max_idle_per_host = max_idle_per_host
+		self.idle_timeout = idle_timeout
+		self.counters = {'connections':0, 'requests':0}
+		self.reset()
+
+	def reset(self):
+		#a forked download worker must not share the parent's sockets, nor a lock the parent held at fork time
+		self.idle = collections.defaultdict(list)
+		self.slots = {}
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			slots = self.slots.get(key)
+			if slots is None:
+				slots = self.slots[key] = threading.BoundedSemaphore(self.max_connections_per_host)
+		slots.acquire()
+		now = time.monotonic()
+		with self.lock:
+			idle = self.idle[key]
+			while idle:
+				connection, released = idle.pop()
+				if now - released < self.idle_timeout:
+					return connection, True
+				connection.close()
+			self.counters['connections'] += 1
+		scheme, host, port = key
+		connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+		return connection_class(host, port), False
+
+	def put(self, key, connection, reusable=True):
+		with self.lock:
+			if reusable and len(self.idle[key]) < self.max_idle_per_host:
+				self.idle[key].append((connection, time.monotonic()))
+			else:
+				connection.close()
+			slots = self.slots.get(key)
+		if slots:
+			slots.release()
+
+	def discard(self, key, connection):
+		self.put(key, connection, reusable=False)
+
+	def get_counters(self):
+		with self.lock:
+			return dict(self.counters)
+
+	def clear(self):
+		with self.lock:
+			for idle in self.idle.values():
+				for connection, _ in idle:
+					connection.close()
+			self.idle.clear()
+
+	def request(self, method, url, headers=None, body=None, redirects=MAX_REDIRECTS):
+		parts = urllib.parse.urlsplit(url)
+		if parts.scheme not in ('http', 'https'):
+			raise ValueError('Invalid URL')
+		if parts.scheme in urllib.request.getproxies() and not urllib.request.proxy_bypass(parts.hostname):
+			#proxies keep going through urllib, which already knows how to talk to them
+			return urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}, method=method, data=body))
+		key = (parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+		target = parts.path or '/'
+		if parts.query:
+			target += '?' + parts.query
+		response = self.send(key, method, target, dict(headers or {}, Host=parts.netloc), body, url)
+		if response.status in REDIRECT_CODES and redirects and response.headers['Location']:
+			response.read()
+			response.close()
+			if response.status in (301, 302, 303) and method not in ('GET', 'HEAD'):
+				method, body = 'GET', None
+			return self.request(method, urllib.parse.urljoin(url, response.headers['Location']), headers, body, redirects-1)
+		if response.status >= 400:
+			error_body = response.read()
+			response.close()
+			raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(error_body))
+		if method == 'HEAD':
+			#there is no body, reading it hands the connection straight back
+			response.read()
+		return response
+
+	def send(self, key, method, target, headers, body, url):
+		while True:
+			connection, reused = self.get(key)
+			with self.lock:
+				self.counters['requests'] += 1
+			try:
+				connection.request(method, target, body=body, headers=headers)
+				response = connection.getresponse()
+			except RETRY_ERRORS:
+				self.discard(key, connection)
+				if reused and method in ('GET', 'HEAD'):
+					continue
+				raise
+			except OSError as e:
+				self.discard(key, connection)
+				raise urllib.error.URLError(e)
+			except:
+				self.discard(key, connection)
+				raise
+			return PooledResponse(self, key, connection, response, url)
+
+
+default_pool = ConnectionPool()
+if hasattr(os, 'register_at_fork'):
+	os.register_at_fork(after_in_child=lambda: default_pool.reset())
+
+
+def request(method, url, headers=None, body=None):
+	return default_pool.request(method, url, headers, body)
+
+
+def execute_pytube_request(url, method=None, headers=None, data=None):
+	#same contract as pytube.request._execute_request, sent through the shared pool
+	if data and not isinstance(data, bytes):
+		data = bytes(json.dumps(data), encoding='utf-8')
+	return request(method or ('POST' if data else 'GET'), url, dict(PYTUBE_HEADERS, **(headers or {})), data)
@@ -1,9 +1,26 @@
-import frontend
-import backend
+import sys
+import time
+import concurrent.futures
 from multiprocessing import freeze_support
 
+
+def load_backend(started):
+	#pytube and the download engines load off the ui thread while the window comes up
+	import backend
+	backend_obj = backend.YTD()
+	backend_obj.record_startup_timing('backend_seconds', time.perf_counter()-started)
+	return backend_obj
+
+
 if __name__ ==  '__main__':
 	freeze_support()
-	backend_obj = backend.YTD()
-	frontend_obj = frontend.YTD(backend_obj)
+	if len(sys.argv) > 1:
+		import cli
+		sys.exit(cli.main(sys.argv[1:]))
+	started = time.perf_counter()
+	executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+	backend_future = executor.submit(load_backend, started)
+	executor.shutdown(wait=False)
+	import frontend
+	frontend_obj = frontend.YTD(backend_future, started)
 	frontend_obj.run()
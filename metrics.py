@@ -0,0 +1,212 @@
+import http.server
+import contextlib
+import collections
+import threading
+import json
+import time
+import os
+
+
+METRICS_LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics.jsonl')
+THROUGHPUT_SAMPLE_INTERVAL = 1.0
+MAX_THROUGHPUT_SAMPLES = 256
+
+STATUS_COMPLETE = 'complete'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+METRIC_TYPES = {
+	'minytd_tasks_total':'counter',
+	'minytd_task_seconds':'summary',
+	'minytd_videos_total':'counter',
+	'minytd_downloaded_bytes_total':'counter',
+	'minytd_retries_total':'counter',
+	'minytd_fallbacks_total':'counter',
+	'minytd_stage_seconds':'summary',
+	'minytd_first_byte_seconds':'summary',
+}
+
+
+class DownloadMetrics:
+	def __init__(self, task_id, video_id, resolution=None):
+		self.task_id = task_id
+		self.video_id = video_id
+		self.resolution = resolution
+		self.status = STATUS_COMPLETE
+		self.error = None
+		self.itags = []
+		self.stream_ids = []
+		self.durations = {}
+		self.retries = 0
+		self.fallbacks = 0
+		self.bytes = 0
+		self.started_at = time.time()
+		self.started = time.monotonic()
+		self.request_started = None
+		self.first_byte = None
+		self.samples = []
+		self.sample_interval = THROUGHPUT_SAMPLE_INTERVAL
+		self.last_sample = self.started
+		self.lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def timer(self, stage):
+		started = time.monotonic()
+		try:
+			yield
+		finally:
+			elapsed = time.monotonic() - started
+			with self.lock:
+				self.durations[stage] = self.durations.get(stage, 0) + elapsed
+
+	def on_request(self):
+		if self.request_started is None:
+			self.request_started = time.monotonic()
+
+	def on_chunk(self, size):
+		now = time.monotonic()
+		with self.lock:
+			if self.first_byte is None and self.request_started is not None:
+				self.first_byte = now - self.request_started
+			self.bytes += size
+			if now - self.last_sample >= self.sample_interval:
+				self.last_sample = now
+				self.samples.append((round(now-self.started, 3), self.bytes))
+				if len(self.samples) >= MAX_THROUGHPUT_SAMPLES:
+					#halve the resolution instead of dropping the tail of long downloads
+					self.samples = self.samples[1::2]
+					self.sample_interval *= 2
+
+	def fail(self, error):
+		self.status = STATUS_FAILED
+		self.error = '{}: {}'.format(type(error).__name__, error)
+
+	def record(self):
+		elapsed = time.monotonic() - self.started
+		download_seconds = self.durations.get('download')
+		return {
+			'event':'video',
+			'task':self.task_id,
+			'video_id':self.video_id,
+			'resolution':self.resolution,
+			'status':self.status,
+			'error':self.error,
+			'itags':self.itags,
+			'started_at':self.started_at,
+			'seconds':elapsed,
+			'durations':self.durations,
+			'first_byte_seconds':self.first_byte,
+			'bytes':self.bytes,
+			'throughput_bps':self.bytes/download_seconds if download_seconds else None,
+			'throughput_samples':self.samples,
+			'retries':self.retries,
+			'fallbacks':self.fallbacks,
+		}
+
+
+class MetricsLog:
+	def __init__(self, path=METRICS_LOG_FILE):
+		self.path = path
+		self.lock = threading.Lock()
+
+	def write(self, entry):
+		if not self.path:
+			return
+		line = json.dumps(entry) + '\n'
+		#one append per record keeps lines whole when several worker processes share the log
+		with self.lock:
+			try:
+				with open(self.path, 'a', encoding='utf-8') as fh:
+					fh.write(line)
+			except OSError:
+				pass
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+	def log_message(self, format, *args):
+		pass
+
+	def do_GET(self):
+		if self.path.partition('?')[0] not in ('/', '/metrics'):
+			self.send_error(404)
+			return
+		body = self.server.exporter.render().encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+
+class MetricsExporter:
+	def __init__(self, port=0, log_path=METRICS_LOG_FILE):
+		self.log_path = log_path
+		self.values = collections.defaultdict(float)
+		self.lock = threading.Lock()
+		#counters start at zero for this session like any other scrape target
+		try:
+			self.offset = os.path.getsize(log_path)
+		except OSError:
+			self.offset = 0
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+		self.server.daemon_threads = True
+		self.server.exporter = self
+
+	def get_url(self):
+		return 'http://{}:{}/metrics'.format(self.server.server_address[0], self.server.server_address[1])
+
+	def start(self):
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def stop(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+	def collect(self):
+		try:
+			with open(self.log_path, 'rb') as fh:
+				fh.seek(self.offset)
+				data = fh.read()
+		except OSError:
+			return
+		complete = data.rfind(b'\n') + 1
+		self.offset += complete
+		for line in data[:complete].splitlines():
+			try:
+				self.add(json.loads(line))
+			except (ValueError, KeyError, TypeError):
+				pass
+
+	def add(self, entry):
+		status = (('status', entry['status']),)
+		if entry['event'] == 'task':
+			self.values[('minytd_tasks_total', status)] += 1
+			self.observe('minytd_task_seconds', (), entry['seconds'])
+		elif entry['event'] == 'video':
+			self.values[('minytd_videos_total', status)] += 1
+			self.values[('minytd_downloaded_bytes_total', ())] += entry['bytes']
+			self.values[('minytd_retries_total', ())] += entry['retries']
+			self.values[('minytd_fallbacks_total', ())] += entry['fallbacks']
+			for stage, seconds in entry['durations'].items():
+				self.observe('minytd_stage_seconds', (('stage', stage),), seconds)
+			if entry['first_byte_seconds'] is not None:
+				self.observe('minytd_first_byte_seconds', (), entry['first_byte_seconds'])
+
+	def observe(self, name, labels, value):
+		self.values[(name+'_sum', labels)] += value
+		self.values[(name+'_count', labels)] += 1
+
+	def render(self):
+		with self.lock:
+			self.collect()
+			values = sorted(self.values.items())
+		lines = []
+		for name, metric_type in sorted(METRIC_TYPES.items()):
+			samples = [(sample, labels, value) for (sample, labels), value in values if sample == name or sample.rpartition('_')[0] == name]
+			if not samples:
+				continue
+			lines.append('# TYPE {} {}'.format(name, metric_type))
+			for sample, labels, value in samples:
+				label_text = ','.join('{}="{}"'.format(key, label) for key, label in labels)
+				lines.append('{}{} {}'.format(sample, '{'+label_text+'}' if label_text else '', repr(value)))
+		return '\n'.join(lines) + '\n'
@@ -0,0 +1,92 @@
+import multiprocessing
+import contextlib
+import threading
+import time
+import os
+
+
+BURST_SECONDS = 0.25
+
+BUCKET_RATE = 0
+BUCKET_TOKENS = 1
+BUCKET_UPDATED = 2
+BUCKET_HOLDER = 3
+BUCKET_FIELDS = 4
+
+
+class TokenBucket:
+	def __init__(self, rate=0, shared=False):
+		if shared:
+			#shared buckets are inherited by worker processes and throttle all of them together
+			self.state = multiprocessing.RawArray('d', BUCKET_FIELDS)
+			self.lock = multiprocessing.Lock()
+		else:
+			self.state = [0.0]*BUCKET_FIELDS
+			self.lock = threading.Lock()
+		self.set_rate(rate)
+
+	@contextlib.contextmanager
+	def locked(self):
+		with self.lock:
+			self.state[BUCKET_HOLDER] = os.getpid()
+			try:
+				yield
+			finally:
+				self.state[BUCKET_HOLDER] = 0
+
+	def recover(self, pid):
+		#a worker killed from outside inside the critical section never releases, its pid is still recorded as the holder
+		if pid and self.state[BUCKET_HOLDER] == pid:
+			self.state[BUCKET_HOLDER] = 0
+			self.lock.release()
+
+	def set_rate(self, rate):
+		with self.locked():
+			self.state[BUCKET_RATE] = max(0, rate)
+
+	def get_rate(self):
+		return self.state[BUCKET_RATE]
+
+	def consume(self, amount):
+		delay = self.reserve(amount)
+		if delay:
+			time.sleep(delay)
+
+	def reserve(self, amount):
+		#unlimited is the common case and costs no cross-process lock per chunk
+		if amount <= 0 or self.state[BUCKET_RATE] <= 0:
+			return 0
+		with self.locked():
+			rate = self.state[BUCKET_RATE]
+			if rate <= 0:
+				return 0
+			now = time.monotonic()
+			elapsed = now - self.state[BUCKET_UPDATED]
+			tokens = min(rate*BURST_SECONDS, self.state[BUCKET_TOKENS] + elapsed*rate) - amount
+			self.state[BUCKET_TOKENS] = tokens
+			self.state[BUCKET_UPDATED] = now
+		#consumers take tokens on credit and wait off their own debt, so waiting is served in arrival order
+		return -tokens/rate if tokens < 0 else 0
+
+
+class RateLimiter:
+	def __init__(self, global_bucket=None, task_rate=None):
+		self.global_bucket = global_bucket
+		self.task_bucket = TokenBucket()
+		self.task_rate = task_rate
+
+	def consume(self, amount):
+		delay = self.reserve(amount)
+		if delay:
+			time.sleep(delay)
+
+	def reserve(self, amount):
+		delay = 0
+		if self.task_rate:
+			rate = self.task_rate()
+			if rate != self.task_bucket.get_rate():
+				self.task_bucket.set_rate(rate)
+			delay = self.task_bucket.reserve(amount)
+		if self.global_bucket:
+			delay = max(delay, self.global_bucket.reserve(amount))
+		return delay
@@ -0,0 +1,245 @@
+import urllib.error
+import concurrent.futures
+import collections
+import itertools
+import threading
+import json
+import os
+import httppool
+
+
+DEFAULT_CONNECTIONS = 4
+RANGE_SIZE = 9437184
+CHUNK_SIZE = 65536
+JOURNAL_INTERVAL = 1048576
+PART_SUFFIX = '.part'
+JOURNAL_SUFFIX = '.journal'
+REQUEST_HEADERS = {'User-Agent': 'Mozilla/5.0', 'accept-language': 'en-US,en'}
+
+
+class RangeNotSupported(Exception):
+	pass
+
+
+class RemoteChanged(Exception):
+	pass
+
+
+def split_ranges(filesize, range_size=RANGE_SIZE):
+	ranges = []
+	start = 0
+	while start < filesize:
+		end = min(start+range_size, filesize) - 1
+		ranges.append((start, end))
+		start = end + 1
+	return ranges
+
+
+def content_range_total(response):
+	try:
+		return int(response.headers['Content-Range'].split('/')[1])
+	except (AttributeError, IndexError, ValueError):
+		return None
+
+
+def open_range(url, start, end, filesize):
+	response = httppool.request('GET', url, dict(REQUEST_HEADERS, Range='bytes={}-{}'.format(start, end)))
+	if response.status != 206:
+		response.close()
+		raise RangeNotSupported(url)
+	total = content_range_total(response)
+	if total is not None and total != filesize:
+		response.close()
+		raise RemoteChanged('{} reports {} bytes, expected {}'.format(url, total, filesize))
+	return response
+
+
+def read_range(response, start, end, position):
+	while position <= end:
+		chunk = response.read(min(CHUNK_SIZE, end-position+1))
+		if not chunk:
+			raise urllib.error.ContentTooShortError('range {}-{} ended at {}'.format(start, end, position), None)
+		position += len(chunk)
+		yield chunk
+
+
+class DownloadJournal:
+	def __init__(self, path):
+		self.path = path
+		self.filesize = None
+		self.range_size = None
+		self.validator = None
+		self.offsets = {}
+		self.lock = threading.Lock()
+
+	def load(self):
+		try:
+			with open(self.path) as fh:
+				state = json.load(fh)
+			self.filesize = state['filesize']
+			self.range_size = state['range_size']
+			self.validator = state['validator']
+			self.offsets = {int(start):confirmed for start, confirmed in state['offsets'].items()}
+			return True
+		except (OSError, ValueError, KeyError, AttributeError):
+			return False
+
+	def matches(self, filesize, range_size, validator):
+		return self.filesize == filesize and self.range_size == range_size and self.validator == validator
+
+	def reset(self, filesize, range_size, validator):
+		with self.lock:
+			self.filesize = filesize
+			self.range_size = range_size
+			self.validator = validator
+			self.offsets = {}
+			self.save()
+
+	def confirmed(self, start):
+		with self.lock:
+			return self.offsets.get(start, 0)
+
+	def confirmed_total(self):
+		with self.lock:
+			return sum(self.offsets.values())
+
+	def commit(self, start, confirmed):
+		with self.lock:
+			self.offsets[start] = confirmed
+			self.save()
+
+	def save(self):
+		state = {'filesize':self.filesize, 'range_size':self.range_size, 'validator':self.validator, 'offsets':self.offsets}
+		tmp_path = self.path + '.tmp'
+		with open(tmp_path, 'w') as fh:
+			json.dump(state, fh)
+		os.replace(tmp_path, self.path)
+
+	def remove(self):
+		try:
+			os.remove(self.path)
+		except FileNotFoundError:
+			pass
+
+
+class SegmentedDownloader:
+	def __init__(self, url, filesize, file_path, connections=DEFAULT_CONNECTIONS, on_progress=None, range_size=RANGE_SIZE):
+		self.url = url
+		self.filesize = filesize
+		self.file_path = file_path
+		self.part_path = file_path + PART_SUFFIX
+		self.journal = DownloadJournal(self.part_path + JOURNAL_SUFFIX)
+		self.connections = max(1, connections)
+		self.on_progress = on_progress
+		self.range_size = range_size
+		self.bytes_remaining = filesize
+		self.lock = threading.Lock()
+
+	def download(self):
+		validator = self.probe()
+		self.prepare(validator)
+		ranges = [r for r in split_ranges(self.filesize, self.range_size) if self.journal.confirmed(r[0]) < r[1]-r[0]+1]
+		self.bytes_remaining = self.filesize - self.journal.confirmed_total()
+		self.report_progress(b'')
+		if ranges:
+			workers = min(self.connections, len(ranges))
+			with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+				for _ in executor.map(self.fetch_range, ranges):
+					pass
+		os.replace(self.part_path, self.file_path)
+		self.journal.remove()
+		return self.file_path
+
+	def discard(self):
+		self.journal.remove()
+		try:
+			os.remove(self.part_path)
+		except FileNotFoundError:
+			pass
+
+	def probe(self):
+		with open_range(self.url, 0, 0, self.filesize) as response:
+			return response.headers.get('ETag') or response.headers.get('Last-Modified')
+
+	def prepare(self, validator):
+		resumable = (
+			self.journal.load()
+			and self.journal.matches(self.filesize, self.range_size, validator)
+			and os.path.isfile(self.part_path)
+			and os.path.getsize(self.part_path) == self.filesize
+		)
+		if not resumable:
+			with open(self.part_path, 'wb') as fh:
+				fh.truncate(self.filesize)
+			self.journal.reset(self.filesize, self.range_size, validator)
+
+	def fetch_range(self, byte_range):
+		start, end = byte_range
+		confirmed = self.journal.confirmed(start)
+		position = start + confirmed
+		with open_range(self.url, position, end, self.filesize) as response:
+			with open(self.part_path, 'r+b') as fh:
+				fh.seek(position)
+				unjournaled = 0
+				for chunk in read_range(response, start, end, position):
+					fh.write(chunk)
+					position += len(chunk)
+					unjournaled += len(chunk)
+					if unjournaled >= JOURNAL_INTERVAL or position > end:
+						fh.flush()
+						os.fsync(fh.fileno())
+						self.journal.commit(start, position-start)
+						unjournaled = 0
+					self.report_progress(chunk)
+
+	def report_progress(self, chunk):
+		with self.lock:
+			self.bytes_remaining -= len(chunk)
+			bytes_remaining = self.bytes_remaining
+		if self.on_progress:
+			self.on_progress(chunk, bytes_remaining)
+
+
+class RangeStreamer:
+	def __init__(self, url, filesize, write, connections=DEFAULT_CONNECTIONS, on_progress=None, range_size=RANGE_SIZE):
+		self.url = url
+		self.filesize = filesize
+		self.write = write
+		self.connections = max(1, connections)
+		self.on_progress = on_progress
+		self.range_size = range_size
+		self.bytes_remaining = filesize
+		self.lock = threading.Lock()
+
+	def stream(self):
+		#ranges are fetched ahead concurrently but written strictly in order,
+		#so at most connections+1 ranges are held in memory
+		ranges = iter(split_ranges(self.filesize, self.range_size))
+		with concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor:
+			pending = collections.deque(executor.submit(self.fetch_range, r) for r in itertools.islice(ranges, self.connections))
+			try:
+				while pending:
+					data = pending.popleft().result()
+					next_range = next(ranges, None)
+					if next_range:
+						pending.append(executor.submit(self.fetch_range, next_range))
+					self.write(data)
+			finally:
+				for future in pending:
+					future.cancel()
+
+	def fetch_range(self, byte_range):
+		start, end = byte_range
+		chunks = []
+		with open_range(self.url, start, end, self.filesize) as response:
+			for chunk in read_range(response, start, end, start):
+				chunks.append(chunk)
+				self.report_progress(chunk)
+		return b''.join(chunks)
+
+	def report_progress(self, chunk):
+		with self.lock:
+			self.bytes_remaining -= len(chunk)
+			bytes_remaining = self.bytes_remaining
+		if self.on_progress:
+			self.on_progress(chunk, bytes_remaining)
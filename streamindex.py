@@ -0,0 +1,65 @@
+def quality(value):
+	#same ordering as pytube's order_by on labels like '720p' or '128kbps'
+	return int(''.join(filter(str.isdigit, value)))
+
+
+def estimate_size(st):
+	#the manifest's contentLength when it had one, otherwise duration times bitrate saves a HEAD request per candidate
+	return st._filesize if st._filesize is not None else st.filesize_approx
+
+
+class StreamIndex:
+	def __init__(self, streams):
+		self.matches = {}
+		self.streams = {}
+		self.best = {}
+		self.best_quality = {}
+		self.resolutions = {True:set(), False:set()}
+		for st in streams:
+			#first stream wins for an exact match and the last of the highest for best, like filter()[0] and order_by()[-1]
+			label = st.resolution if st.type == 'video' else st.abr
+			self.matches.setdefault((st.type, st.is_progressive, st.subtype, label), st)
+			self.streams.setdefault((st.type, st.is_progressive, st.subtype), []).append(st)
+			if label:
+				key = (st.type, st.is_progressive, st.subtype)
+				if quality(label) >= self.best_quality.get(key, -1):
+					self.best[key] = st
+					self.best_quality[key] = quality(label)
+			if st.resolution:
+				self.resolutions[st.is_progressive].add(quality(st.resolution))
+
+	def get(self, type, progressive, subtype, label):
+		return self.matches.get((type, progressive, subtype, label))
+
+	def get_best(self, type, progressive, subtype):
+		return self.best.get((type, progressive, subtype))
+
+	def get_all(self, type, progressive, subtype):
+		return self.streams.get((type, progressive, subtype), [])
+
+	def get_best_within(self, size, adaptive=True, max_quality=None):
+		#the highest resolution whose progressive stream or video and audio pair fits in size, else the smallest there is
+		candidates = [(st, st, estimate_size(st)) for st in self.get_all('video', True, 'mp4')]
+		audio_stream = self.get_best('audio', False, 'mp4')
+		if adaptive and audio_stream:
+			audio_size = estimate_size(audio_stream)
+			candidates += [({'video':st, 'audio':audio_stream}, st, estimate_size(st)+audio_size) for st in self.get_all('video', False, 'mp4')]
+		candidates = [c for c in candidates if c[1].resolution and (max_quality is None or quality(c[1].resolution) <= max_quality)]
+		if not candidates:
+			return None
+		fitting = [c for c in candidates if c[2] <= size]
+		if fitting:
+			return max(fitting, key=lambda c: (quality(c[1].resolution), -c[2]))[0]
+		return min(candidates, key=lambda c: c[2])[0]
+
+	def get_resolutions(self, progressive_only=False):
+		resolutions = self.resolutions[True] if progressive_only else self.resolutions[True] | self.resolutions[False]
+		return [str(x)+'p' for x in sorted(resolutions, reverse=True)]
+
+
+def get_stream_index(yt):
+	#built once per video and kept on it, so it travels with the video object to the download workers
+	index = getattr(yt, 'stream_index', None)
+	if index is None:
+		index = yt.stream_index = StreamIndex(yt.fmt_streams)
+	return index
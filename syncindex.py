@@ -0,0 +1,59 @@
+import threading
+import json
+import time
+import os
+
+
+INDEX_FILENAME = '.minytd-index.jsonl'
+
+
+class DownloadIndex:
+	def __init__(self, directory):
+		self.directory = directory
+		self.path = os.path.join(directory, INDEX_FILENAME)
+		self.entries = None
+		self.lock = threading.Lock()
+
+	def load(self):
+		#the index is an append-only log so several tasks can share a destination, the last entry per video wins
+		entries = {}
+		try:
+			with open(self.path, encoding='utf-8') as fh:
+				for line in fh:
+					try:
+						entry = json.loads(line)
+						entries[entry['video_id']] = entry
+					except (ValueError, KeyError, TypeError):
+						pass
+		except FileNotFoundError:
+			pass
+		return entries
+
+	def lookup(self, video_id):
+		with self.lock:
+			if self.entries is None:
+				self.entries = self.load()
+			return self.entries.get(video_id)
+
+	def is_complete(self, video_id, resolution):
+		entry = self.lookup(video_id)
+		if not entry or entry['resolution'] != resolution:
+			return False
+		path = os.path.join(self.directory, entry['path'])
+		return os.path.isfile(path) and os.path.getsize(path) == entry['size']
+
+	def record(self, video_id, resolution, itags, path, title):
+		entry = {
+			'video_id':video_id,
+			'resolution':resolution,
+			'itags':itags,
+			'path':os.path.relpath(path, self.directory),
+			'size':os.path.getsize(path),
+			'title':title,
+			'completed_at':time.time(),
+		}
+		with self.lock:
+			with open(self.path, 'a', encoding='utf-8') as fh:
+				fh.write(json.dumps(entry) + '\n')
+			if self.entries is not None:
+				self.entries[video_id] = entry
@@ -0,0 +1,237 @@
+import functools
+import hashlib
+import os
+import threading
+import time
+import pytest
+import backend
+import benchmark
+import cache
+import contentstore
+import metrics
+import segmented
+
+
+SIZE = 2*1024*1024
+TIMEOUT = 60
+
+
+@pytest.fixture
+def cdn():
+	cdn = benchmark.FakeCDN()
+	cdn.start()
+	yield cdn
+	cdn.stop()
+
+
+@pytest.fixture
+def ytd(tmp_path, monkeypatch):
+	#worker processes are forked after this, so they write to the test's files as well
+	monkeypatch.setattr(cache, 'ManifestCache', functools.partial(cache.ManifestCache, str(tmp_path / 'manifest-cache.sqlite3')))
+	monkeypatch.setattr(metrics, 'MetricsLog', functools.partial(metrics.MetricsLog, str(tmp_path / 'metrics.jsonl')))
+	monkeypatch.setattr(contentstore, 'ContentStore', lambda: None)
+	ytd = backend.YTD()
+	yield ytd
+	ytd.shutdown()
+
+
+def add_video(cdn, number, data):
+	#every task gets its own video object, like ones resolved from separate urls
+	video_id = benchmark.fake_video_id(number)
+	return lambda: benchmark.fake_video(cdn, video_id, 'Test video {}'.format(video_id), [(benchmark.PROGRESSIVE_360P, data)])
+
+
+def output_path(destination, video_obj):
+	return os.path.join(destination, video_obj.streams.get_by_itag(benchmark.PROGRESSIVE_360P[0]).default_filename)
+
+
+def wait_for(tasks):
+	deadline = time.monotonic() + TIMEOUT
+	while not all(task.is_complete() or task.is_failed() for task in tasks):
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+
+
+def digest(path):
+	with open(path, 'rb') as fh:
+		return hashlib.sha256(fh.read()).digest()
+
+
+def test_shared_progress_round_trip():
+	table = backend.ProgressTable(4)
+	shared_progress_obj = table.allocate()
+	shared_progress_obj.on_start()
+	shared_progress_obj.update_progress(25, 100)
+	assert shared_progress_obj.get_progress() == 25
+	assert shared_progress_obj.read()[backend.SLOT_SEQUENCE] % 2 == 0
+	shared_progress_obj.on_complete()
+	assert shared_progress_obj.get_completion_status()
+	assert table.read_many([shared_progress_obj]) == [shared_progress_obj.read()]
+
+
+def test_slot_caught_mid_write_is_read_again():
+	table = backend.ProgressTable(4)
+	shared_progress_obj = table.allocate()
+	shared_progress_obj.update_progress(50, 100)
+	base = shared_progress_obj.base
+	#a writer that died between its two sequence bumps leaves the slot odd for good
+	table.values[base+backend.SLOT_SEQUENCE] += 1
+	table.values[base+backend.SLOT_DONE] = 75
+	fields = table.read_many([shared_progress_obj])[0]
+	assert fields[backend.SLOT_SEQUENCE] % 2 == 1
+	assert fields[backend.SLOT_DONE] == 75
+
+
+def test_released_slot_ignores_late_writes():
+	table = backend.ProgressTable(1)
+	shared_progress_obj = table.allocate()
+	shared_progress_obj.update_progress(10, 100)
+	table.release(shared_progress_obj)
+	other = table.allocate()
+	assert other.slot == shared_progress_obj.slot
+	shared_progress_obj.on_failure()
+	assert not other.get_failure_status()
+	assert shared_progress_obj.get_progress() == 10
+	with pytest.raises(RuntimeError):
+		table.allocate()
+
+
+def test_task_downloads_the_source(cdn, ytd, tmp_path):
+	data = benchmark.synthetic_data(SIZE)
+	video = add_video(cdn, 0, data)
+	destination = str(tmp_path / 'dest')
+	tasks = [ytd.create_task(video(), None, '360p', destination)]
+	ytd.engine = backend.ENGINE_ASYNCIO
+	tasks.append(ytd.create_task(video(), None, '360p', str(tmp_path / 'async')))
+	for task in tasks:
+		task.start()
+	wait_for(tasks)
+	for task in tasks:
+		assert task.is_complete()
+		assert digest(output_path(task.destination, task.video_obj)) == hashlib.sha256(data).digest()
+		assert not os.path.exists(task.staging_directory)
+
+
+def test_killed_task_resumes(cdn, ytd, tmp_path, monkeypatch):
+	monkeypatch.setattr(segmented, 'JOURNAL_INTERVAL', segmented.CHUNK_SIZE)
+	cdn.bandwidth = SIZE
+	data = benchmark.synthetic_data(SIZE)
+	video = add_video(cdn, 0, data)
+	destination = str(tmp_path / 'dest')
+	task = ytd.create_task(video(), None, '360p', destination)
+	task.start()
+	deadline = time.monotonic() + TIMEOUT
+	while task.get_progress() < 30:
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+	task.kill()
+	assert task.is_killed()
+	journals = [os.path.join(root, name) for root, _, names in os.walk(task.staging_directory) for name in names if name.endswith(segmented.JOURNAL_SUFFIX)]
+	assert len(journals) == 1
+	journal = segmented.DownloadJournal(journals[0])
+	assert journal.load() and journal.confirmed_total() > 0
+	cdn.bandwidth = 0
+	task = ytd.create_task(video(), None, '360p', destination)
+	task.start()
+	wait_for([task])
+	assert task.is_complete()
+	assert digest(output_path(destination, task.video_obj)) == hashlib.sha256(data).digest()
+
+
+def test_discard_removes_staged_files(cdn, ytd, tmp_path):
+	cdn.bandwidth = SIZE
+	video = add_video(cdn, 0, benchmark.synthetic_data(SIZE))
+	task = ytd.create_task(video(), None, '360p', str(tmp_path / 'dest'))
+	task.start()
+	deadline = time.monotonic() + TIMEOUT
+	while task.get_progress() < 10:
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+	task.discard()
+	assert not os.path.exists(task.staging_directory)
+
+
+def test_second_task_for_the_same_video_is_turned_away(cdn, ytd, tmp_path):
+	cdn.bandwidth = SIZE
+	data = benchmark.synthetic_data(SIZE)
+	video = add_video(cdn, 0, data)
+	destination = str(tmp_path / 'dest')
+	first = ytd.create_task(video(), None, '360p', destination)
+	first.start()
+	deadline = time.monotonic() + TIMEOUT
+	while first.get_progress() < 10:
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+	second = ytd.create_task(video(), None, '360p', destination)
+	second.start()
+	wait_for([first, second])
+	assert first.is_complete() and second.is_failed()
+	assert digest(output_path(destination, first.video_obj)) == hashlib.sha256(data).digest()
+
+
+def test_scheduler_runs_tasks_by_priority(cdn, ytd, tmp_path):
+	ytd.set_max_concurrency(1)
+	cdn.bandwidth = SIZE
+	priorities = [backend.PRIORITY_LOW, backend.PRIORITY_LOW, backend.PRIORITY_NORMAL, backend.PRIORITY_HIGH]
+	tasks = []
+	for number, priority in enumerate(priorities):
+		task = ytd.create_task(add_video(cdn, number, benchmark.synthetic_data(SIZE, number))(), None, '360p', str(tmp_path / str(number)), priority)
+		task.start()
+		tasks.append(task)
+		#the first one has a worker before the rest are queued
+		time.sleep(0.1)
+	wait_for(tasks)
+	finished = sorted(range(len(tasks)), key=lambda number: os.stat(output_path(tasks[number].destination, tasks[number].video_obj)).st_mtime_ns)
+	assert finished == [0, 3, 2, 1]
+
+
+def test_async_engine_runs_tasks_by_priority(cdn, ytd, tmp_path, monkeypatch):
+	ytd.engine = backend.ENGINE_ASYNCIO
+	ytd.set_max_concurrency(1)
+	cdn.bandwidth = SIZE
+	started = []
+	download_async = backend.AsyncTaskDownloader.download_async
+	async def record_start(downloader):
+		started.append(downloader.video_obj.video_id)
+		await download_async(downloader)
+	monkeypatch.setattr(backend.AsyncTaskDownloader, 'download_async', record_start)
+	priorities = [backend.PRIORITY_LOW, backend.PRIORITY_LOW, backend.PRIORITY_NORMAL, backend.PRIORITY_HIGH, backend.PRIORITY_HIGH]
+	tasks = []
+	for number, priority in enumerate(priorities):
+		task = ytd.create_task(add_video(cdn, number, benchmark.synthetic_data(SIZE, number))(), None, '360p', str(tmp_path / str(number)), priority)
+		task.start()
+		tasks.append(task)
+		time.sleep(0.05)
+	#a task killed while it waits gives up its place
+	tasks.pop().kill()
+	wait_for(tasks)
+	assert started == [benchmark.fake_video_id(number) for number in (0, 3, 2, 1)]
+
+
+def test_failed_task_leaves_the_scheduler_running(cdn, ytd, tmp_path):
+	ytd.set_max_concurrency(1)
+	missing = add_video(cdn, 0, benchmark.synthetic_data(SIZE))()
+	cdn.resources.clear()
+	unpicklable = add_video(cdn, 1, benchmark.synthetic_data(SIZE))()
+	unpicklable.lock = threading.Lock()
+	tasks = [ytd.create_task(missing, None, '360p', str(tmp_path / 'missing')), ytd.create_task(unpicklable, None, '360p', str(tmp_path / 'unpicklable'))]
+	tasks.append(ytd.create_task(add_video(cdn, 2, benchmark.synthetic_data(SIZE))(), None, '360p', str(tmp_path / 'dest')))
+	for task in tasks:
+		task.start()
+	wait_for(tasks)
+	assert [task.is_complete() for task in tasks] == [False, False, True]
+	assert [task.is_failed() for task in tasks] == [True, True, False]
+
+
+def test_task_fails_when_its_worker_is_killed(cdn, ytd, tmp_path):
+	cdn.bandwidth = SIZE//4
+	task = ytd.create_task(add_video(cdn, 0, benchmark.synthetic_data(SIZE))(), None, '360p', str(tmp_path / 'dest'))
+	task.start()
+	deadline = time.monotonic() + TIMEOUT
+	while not ytd.scheduler.busy_workers or task.get_progress() <= 0:
+		assert time.monotonic() < deadline
+		time.sleep(0.05)
+	#like the oom killer, the worker never gets to report back
+	ytd.scheduler.busy_workers[0].process.kill()
+	wait_for([task])
+	assert task.is_failed()
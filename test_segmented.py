@@ -0,0 +1,140 @@
+import asyncio
+import os
+import pytest
+import aioengine
+import benchmark
+import segmented
+
+
+SIZE = 3*1024*1024
+RANGE_SIZE = 256*1024
+
+
+class Interrupted(Exception):
+	pass
+
+
+@pytest.fixture
+def cdn():
+	cdn = benchmark.FakeCDN()
+	cdn.start()
+	yield cdn
+	cdn.stop()
+
+
+def read_file(path):
+	with open(path, 'rb') as fh:
+		return fh.read()
+
+
+def test_split_ranges_cover_the_file():
+	ranges = segmented.split_ranges(10, 4)
+	assert ranges == [(0, 3), (4, 7), (8, 9)]
+	assert segmented.split_ranges(0, 4) == []
+
+
+def test_download_matches_the_source(cdn, tmp_path):
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	file_path = str(tmp_path / 'video.mp4')
+	reports = []
+	downloader = segmented.SegmentedDownloader(url, SIZE, file_path, 4, lambda chunk, bytes_remaining: reports.append(bytes_remaining), RANGE_SIZE)
+	assert downloader.download() == file_path
+	assert read_file(file_path) == data
+	assert reports[0] == SIZE and reports[-1] == 0
+	assert sorted(os.listdir(tmp_path)) == ['video.mp4']
+
+
+def test_interrupted_download_resumes_from_the_journal(cdn, tmp_path, monkeypatch):
+	monkeypatch.setattr(segmented, 'JOURNAL_INTERVAL', segmented.CHUNK_SIZE)
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	file_path = str(tmp_path / 'video.mp4')
+	def interrupt(chunk, bytes_remaining):
+		if bytes_remaining < SIZE//2:
+			raise Interrupted()
+	with pytest.raises(Interrupted):
+		segmented.SegmentedDownloader(url, SIZE, file_path, 1, interrupt, RANGE_SIZE).download()
+	assert not os.path.exists(file_path)
+	reports = []
+	segmented.SegmentedDownloader(url, SIZE, file_path, 4, lambda chunk, bytes_remaining: reports.append((len(chunk), bytes_remaining)), RANGE_SIZE).download()
+	assert read_file(file_path) == data
+	#the first report is the resume point, only the rest of the file is fetched again
+	assert reports[0][1] <= SIZE//2
+	assert sum(length for length, _ in reports) == reports[0][1]
+	assert not os.path.exists(file_path + segmented.PART_SUFFIX + segmented.JOURNAL_SUFFIX)
+
+
+def test_stale_journal_is_not_trusted(cdn, tmp_path):
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	file_path = str(tmp_path / 'video.mp4')
+	part_path = file_path + segmented.PART_SUFFIX
+	with open(part_path, 'wb') as fh:
+		fh.truncate(SIZE)
+	journal = segmented.DownloadJournal(part_path + segmented.JOURNAL_SUFFIX)
+	journal.reset(SIZE, RANGE_SIZE, 'an older validator')
+	for start, end in segmented.split_ranges(SIZE, RANGE_SIZE):
+		journal.commit(start, end-start+1)
+	segmented.SegmentedDownloader(url, SIZE, file_path, 4, None, RANGE_SIZE).download()
+	assert read_file(file_path) == data
+
+
+def test_size_mismatch_raises_remote_changed(cdn, tmp_path):
+	url = cdn.add('video', benchmark.synthetic_data(SIZE))
+	downloader = segmented.SegmentedDownloader(url, SIZE+1, str(tmp_path / 'video.mp4'), 4, None, RANGE_SIZE)
+	with pytest.raises(segmented.RemoteChanged):
+		downloader.download()
+
+
+def test_server_without_ranges_raises_range_not_supported(tmp_path):
+	cdn = benchmark.FakeCDN(ranges=False)
+	cdn.start()
+	try:
+		url = cdn.add('video', benchmark.synthetic_data(SIZE))
+		with pytest.raises(segmented.RangeNotSupported):
+			segmented.SegmentedDownloader(url, SIZE, str(tmp_path / 'video.mp4'), 4, None, RANGE_SIZE).download()
+		with pytest.raises(segmented.RangeNotSupported):
+			segmented.RangeStreamer(url, SIZE, lambda data: None, 4, None, RANGE_SIZE).stream()
+	finally:
+		cdn.stop()
+
+
+def test_range_streamer_writes_in_order(cdn):
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	written = []
+	segmented.RangeStreamer(url, SIZE, written.append, 4, None, RANGE_SIZE).stream()
+	assert b''.join(written) == data
+
+
+def test_async_download_matches_the_source(cdn, tmp_path):
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	file_path = str(tmp_path / 'video.mp4')
+	received = []
+	async def on_chunk(chunk):
+		received.append(len(chunk))
+	asyncio.run(aioengine.download(url, SIZE, file_path, 4, on_chunk))
+	assert read_file(file_path) == data
+	assert sum(received) == SIZE
+
+
+def test_async_download_drops_the_segmented_journal(cdn, tmp_path, monkeypatch):
+	monkeypatch.setattr(segmented, 'JOURNAL_INTERVAL', segmented.CHUNK_SIZE)
+	data = benchmark.synthetic_data(SIZE)
+	url = cdn.add('video', data)
+	file_path = str(tmp_path / 'video.mp4')
+	def interrupt(chunk, bytes_remaining):
+		if bytes_remaining < SIZE//2:
+			raise Interrupted()
+	with pytest.raises(Interrupted):
+		segmented.SegmentedDownloader(url, SIZE, file_path, 1, interrupt, RANGE_SIZE).download()
+	async def fail(chunk):
+		raise Interrupted()
+	#a killed process gets no cleanup, the zeroed part file stays behind
+	monkeypatch.setattr(aioengine, 'remove_file', lambda file_path: None)
+	with pytest.raises(Interrupted):
+		asyncio.run(aioengine.download(url, SIZE, file_path, 4, fail))
+	segmented.SegmentedDownloader(url, SIZE, file_path, 4, None, RANGE_SIZE).download()
+	assert read_file(file_path) == data